@@ -0,0 +1,918 @@
+# Python 2.7 and 3.5
+# Vectorized variant of MeshTweaker.Tweak, working on numpy arrays.
+
+import math
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from MeshTweaker import Tweak, TweakMetrics
+from IndexedMesh import IndexedMesh, decimate, weld
+from FacetTree import FacetTree
+from ConvexHull import stable_poses
+
+# Number of facets, that are projected at once. Each chunk allocates about
+# 100 * CHUNK_SIZE * K bytes, with K the number of examined orientations.
+# The heights of all vertices of an IndexedMesh are only held, if they take
+# no more, see _project_vertices().
+CHUNK_SIZE = 32768
+
+# Bins per cube edge of the sphere histogram, a bin covers about 2 degrees
+HISTOGRAM_RESOLUTION = 45
+# Rounded unit vector coordinates lie in [-10**6, 10**6] millionths
+DIRECTION_OFFSET = 10**6
+DIRECTION_BASE = 2 * 10**6 + 1
+# Candidate generators of ArrayTweak
+CANDIDATES = ("area", "histogram", "hull")
+# Local search of ArrayTweak.refine_orientations: number of start
+# orientations and the first and the last step in rad
+REFINE_STARTS = 3
+REFINE_STEP = 0.1
+REFINE_MIN_STEP = 0.005
+# Orientations of the best proxy scores, among which proxy_agreement looks
+# for the best full score
+PROXY_KEEP = 4
+
+
+def as_triangles(mesh):
+    '''Bring a mesh into the (N,3,3) triangle array format.
+    Accepted are the flat vertex list used by Tweak, (3N,3) and (N,3,3)
+    arrays, binary STL records as returned by FileHandler.mapBinarySTL and
+    IndexedMesh objects, which are returned as they are. float32 and float64
+    arrays and the records are used without a copy.'''
+    if isinstance(mesh, IndexedMesh):
+        return mesh
+    names = getattr(getattr(mesh, "dtype", None), "names", None)
+    if names is not None and "v0" in names:
+        # v0, v1 and v2 follow each other, one strided view covers all three
+        v0 = mesh["v0"]
+        return np.lib.stride_tricks.as_strided(v0, shape=(len(mesh), 3, 3),
+                   strides=(v0.strides[0], v0.strides[1]*3, v0.strides[1]),
+                   writeable=False)
+    tri = np.asarray(mesh)
+    if tri.dtype not in (np.float32, np.float64):
+        tri = tri.astype(np.float64)
+    if tri.ndim == 2:
+        tri = tri.reshape(-1, 3, 3)
+    if tri.ndim != 3 or tri.shape[1:] != (3, 3):
+        raise ValueError("Mesh must have the shape (N,3,3), got %s" % (tri.shape,))
+    return tri
+
+
+def facet_normals(triangles):
+    '''Returning the (N,3) area vectors of the facets as Tweak.arrange_mesh
+    does: not normalized, the length is twice the facet area.'''
+    a = np.empty((len(triangles), 3))
+    for s in _chunks(len(triangles), CHUNK_SIZE):
+        tri = np.asarray(triangles[s], dtype=np.float64)
+        v = tri[:, 1] - tri[:, 0]
+        w = tri[:, 2] - tri[:, 0]
+        a[s, 0] = v[:, 1]*w[:, 2] - v[:, 2]*w[:, 1]
+        a[s, 1] = v[:, 2]*w[:, 0] - v[:, 0]*w[:, 2]
+        a[s, 2] = v[:, 0]*w[:, 1] - v[:, 1]*w[:, 0]
+        a[s] = decimal_round(a[s], 6)
+    return a
+
+
+def decimal_round(x, decimals):
+    '''Rounding x to decimals as round() and "{:1.4f}".format() do, to the
+    decimal nearest to the exact float. np.round scales x first, which can
+    round values close to the middle of two decimals to the wrong side, so
+    round() takes those one by one.'''
+    x = np.asarray(x, dtype=np.float64)
+    scale = 10.0 ** decimals
+    t = x * scale
+    r = np.rint(t)
+    # The scaled values are off by up to half an ulp
+    middle = 0.5 - 1e-15 * max(float(t.max()), -float(t.min()), 1.0) if t.size else 0.5
+    t -= r
+    index = np.flatnonzero(np.abs(t, out=t) >= middle)
+    r /= scale
+    if len(index):
+        r.flat[index] = [round(float(v), decimals) for v in x.flat[index]]
+    return r
+
+
+def _dot3(p, V):
+    '''Returning the (M,K) dot products of the (M,3) array p and the (3,K)
+    vectors V, summed up as Tweak does. np.dot can round differently, which
+    decides the rounding of the facet areas close to the middle.'''
+    return p[:, 0, None]*V[0] + p[:, 1, None]*V[1] + p[:, 2, None]*V[2]
+
+
+def perimeters(triangles):
+    '''Returning the perimeter of each facet'''
+    p = np.asarray(triangles, dtype=np.float64)
+    length = np.zeros(len(p))
+    for i, j in ((0, 1), (0, 2), (1, 2)):
+        d = p[:, j] - p[:, i]
+        length += np.sqrt(d[:, 0]**2 + d[:, 1]**2 + d[:, 2]**2)
+    return length
+
+
+def touching_line(triangles, index):
+    '''Returning the length of the edges of the facets index, counting an
+    edge of two of these facets only once. The facets of an IndexedMesh
+    share their vertex indices, those of a triangle array are welded.'''
+    index = np.asarray(index, dtype=np.int64)
+    if len(index) == 0:
+        return 0.0
+    if isinstance(triangles, IndexedMesh):
+        vertices = triangles.vertices
+        faces = triangles.faces.take(index, axis=0)
+    else:
+        vertices, faces = weld(triangles[index])
+    faces = faces.astype(np.int64)
+    edges = np.concatenate((faces[:, [0, 1]], faces[:, [0, 2]], faces[:, [1, 2]]))
+    edges.sort(axis=1)
+    keys = np.unique(edges[:, 0] * len(vertices) + edges[:, 1])
+    d = (vertices.take(keys % len(vertices), axis=0).astype(np.float64)
+         - vertices.take(keys // len(vertices), axis=0))
+    return float(np.sqrt(d[:, 0]**2 + d[:, 1]**2 + d[:, 2]**2).sum())
+
+
+def corners(triangles, index):
+    '''Returning the vertices of the given flat corner indices, the vertex
+    k being corner k % 3 of facet k // 3, as float64 (len(index),3) array'''
+    index = np.asarray(index)
+    if isinstance(triangles, IndexedMesh):
+        points = triangles.vertices.take(triangles.faces.take(index), axis=0)
+    else:
+        points = triangles[index // 3, index % 3]
+    return np.asarray(points, dtype=np.float64)
+
+
+def direction_keys(directions):
+    '''Returning an int64 key of each (N,3) unit vector rounded to 6
+    decimals. The three rounded coordinates take 21 bits each, so equal
+    keys mean equal rounded vectors, with -0.0 equal to 0.0.'''
+    q = np.rint(decimal_round(directions, 6) * 1e6).astype(np.int64)
+    q += DIRECTION_OFFSET
+    return (q[:, 0] * DIRECTION_BASE + q[:, 1]) * DIRECTION_BASE + q[:, 2]
+
+
+def key_direction(key):
+    '''Returning the rounded vector of a key of direction_keys() as list'''
+    key = int(key)
+    z = key % DIRECTION_BASE - DIRECTION_OFFSET
+    y = key // DIRECTION_BASE % DIRECTION_BASE - DIRECTION_OFFSET
+    x = key // DIRECTION_BASE**2 - DIRECTION_OFFSET
+    # The quotient is the float nearest to the decimal, as round() returns
+    return [x / 1e6 + 0.0, y / 1e6 + 0.0, z / 1e6 + 0.0]
+
+
+def sphere_bins(directions, resolution=HISTOGRAM_RESOLUTION):
+    '''Returning the bin of each (N,3) unit vector on a cube sphere with
+    6 * resolution**2 bins. The coordinates on each cube face are mapped by
+    their angle, so the bins cover about the same solid angle.'''
+    d = np.asarray(directions, dtype=np.float64)
+    rows = np.arange(len(d))
+    axis = np.abs(d).argmax(axis=1)
+    major = d[rows, axis]
+    face = 2*axis + (major < 0)
+    index = face
+    for shift in (1, 2):
+        coord = d[rows, (axis + shift) % 3] / np.abs(major)
+        cell = ((np.arctan(coord) * (4/math.pi) + 1) * (resolution/2.0)).astype(np.intp)
+        index = index * resolution + np.clip(cell, 0, resolution - 1)
+    return index
+
+
+def sphere_histogram(normals, best_n, resolution=HISTOGRAM_RESOLUTION,
+                     radius=10.0, min_share=0.5):
+    '''Searching the best_n peaks of the area vector field as candidates.
+    The area vectors are binned by direction on a cube sphere, weighted by
+    their length. The fullest bin is refined to the mean direction of its
+    area vectors and claims all area vectors within radius degrees, which
+    are then taken out of the histogram before the next peak is searched.
+    Peaks are dropped, that claim less than min_share of the area, which a
+    cap of radius holds, if the area vectors cover the sphere uniformly.
+    So curved and scanned surfaces give few candidates instead of many
+    noisy ones. Returns [[vector, cumulated area], ...] as
+    Tweak.area_cumulation.'''
+    a = np.asarray(normals, dtype=np.float64)
+    A = np.sqrt(a[:, 0]*a[:, 0] + a[:, 1]*a[:, 1] + a[:, 2]*a[:, 2])
+    valid = A > 0
+    a, A = a[valid], A[valid]
+    if len(a) == 0:
+        return list()
+    directions = a / A[:, None]
+    size = 6 * resolution**2
+    bins = sphere_bins(directions, resolution)
+    area = np.bincount(bins, weights=A, minlength=size)
+    min_cos = math.cos(radius * math.pi/180)
+    # A cap covers (1 - cos(radius)) / 2 of the sphere
+    min_area = min_share * A.sum() * (1 - min_cos) / 2
+    free = np.ones(len(a), dtype=bool)
+
+    peaks = list()
+    # Each bin has a few neighbours within radius, so few tries suffice
+    for _ in range(4 * best_n):
+        b = area.argmax()
+        if len(peaks) == best_n or area[b] <= 0:
+            break
+        # The sum of the area vectors of a bin points in their mean direction
+        members = free & (bins == b)
+        mean = a[members].sum(axis=0)
+        mean = np.round(mean / np.sqrt(mean.dot(mean)), 6) + 0.0
+        claimed = free & (np.dot(directions, mean) > min_cos)
+        claimed |= members
+        cumulated = A[claimed].sum()
+        area -= np.bincount(bins[claimed], weights=A[claimed], minlength=size)
+        area[b] = 0  # Against rounding leftovers
+        free &= ~claimed
+        if cumulated >= min_area:
+            peaks.append([mean.tolist(), float("{:2f}".format(cumulated))])
+    return peaks
+
+
+def _chunks(size, chunk_size):
+    for start in range(0, size, chunk_size):
+        yield slice(start, min(start + chunk_size, size))
+
+
+def _map_chunks(func, size, chunk_size, workers, checkpoint=None):
+    '''Applying func to the chunk slices, on several threads if workers > 1.
+    numpy releases the GIL in the chunk kernels, so threads run in parallel.
+    The results are returned in chunk order in any case.
+    checkpoint(done, size) is called before each chunk, on the thread of the
+    chunk. It may raise to stop, further chunks then fail at once.'''
+    slices = _chunks(size, chunk_size)
+    if checkpoint is not None:
+        kernel = func
+        def func(s):
+            checkpoint(s.start, size)
+            return kernel(s)
+    if workers <= 1:
+        return map(func, slices)
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(func, slices))
+
+
+def approach_batch(triangles, vectors, chunk_size=CHUNK_SIZE, workers=1,
+                   checkpoint=None):
+    '''Returning the lowest vertex height regarding each of the K vectors.
+    All vertices of a chunk are projected with one (3c,3) x (3,K) product.
+    The vertices of an IndexedMesh are projected instead of the triangles.
+    checkpoint is called between the chunks, see _map_chunks().'''
+    V = np.asarray(vectors, dtype=np.float64).reshape(-1, 3).T
+    if isinstance(triangles, IndexedMesh):
+        points, size = triangles.vertices, len(triangles.vertices)
+    else:
+        points, size = triangles, len(triangles)
+
+    def chunk_min(s):
+        verts = np.asarray(points[s], dtype=np.float64).reshape(-1, 3)
+        return np.dot(verts, V).min(axis=0)
+
+    amin = np.full(V.shape[1], np.inf)
+    for part in _map_chunks(chunk_min, size, chunk_size, workers, checkpoint):
+        np.minimum(amin, part, out=amin)
+    return amin
+
+
+def _project_vertices(triangles, V, chunk_size, workers):
+    '''Returning the (V,K) heights of the vertices of an IndexedMesh or None
+    for a triangle array. They take 8 * V * K bytes, of more vertices than
+    fit into the 100 * chunk_size * K bytes of a chunk, None is returned and
+    the chunks project the vertices of their facets, see _facet_terms().'''
+    if (not isinstance(triangles, IndexedMesh)
+            or 8 * len(triangles.vertices) > 100 * chunk_size):
+        return None
+    projected = np.empty((len(triangles.vertices), V.shape[1]))
+    def project(s):
+        projected[s] = np.dot(np.asarray(triangles.vertices[s],
+                                         dtype=np.float64), V)
+    list(_map_chunks(project, len(triangles.vertices), chunk_size, workers))
+    return projected
+
+
+def _lowest_heights(triangles, V, projected, chunk_size, workers):
+    '''Returning the lowest heights regarding the vectors V, those of an
+    IndexedMesh from the heights of its projected vertices'''
+    if projected is None:
+        return approach_batch(triangles, V.T, chunk_size, workers)
+    return projected.min(axis=0, initial=np.inf)
+
+
+def _damped(a, norma, ali, V):
+    '''Returning the overhang areas 0.8 * ali of the (c,3) area vectors a
+    regarding the vectors V, undamped where an area vector equals -n
+    exactly. This needs the length of a to lie within 0.00001 of the one
+    of n, so only such rows are compared.'''
+    damped = 0.8 * ali
+    length = np.sqrt((V * V).sum(axis=0))
+    rows = np.flatnonzero((norma >= length.min() - 0.00002)
+                          & (norma <= length.max() + 0.00002))
+    if len(rows):
+        b = a[rows]
+        dist = (np.abs(b[:, 0, None] + V[0]) + np.abs(b[:, 1, None] + V[1])
+                + np.abs(b[:, 2, None] + V[2]))
+        damped[rows] = np.where(dist > 0.00001, damped[rows], ali[rows])
+    return damped
+
+
+def _facet_terms(triangles, normals, V, touching_height, s, projected=None):
+    '''Returning the terms of the facets in slice s regarding the vectors V,
+    each as (c,K) array: the cosines of the area vectors, nan for facets
+    with an area vector shorter than 2, the touching areas, the damped
+    overhang areas, the mask of the overhangs and the mask of the facets,
+    that touch with all three vertices. Last, the float64 triangles of s or
+    None, if the heights came from the projected vertices.'''
+    a = np.asarray(normals[s], dtype=np.float64)
+    c = len(a)
+    K = V.shape[1]
+    if projected is None:
+        tri = np.asarray(triangles[s], dtype=np.float64)
+        heights = np.dot(tri.reshape(-1, 3), V).reshape(c, 3, K)
+    else:
+        tri = None
+        heights = projected.take(triangles.faces[s], axis=0)
+    an = heights.min(axis=1)
+
+    norma = np.sqrt(a[:, 0]*a[:, 0] + a[:, 1]*a[:, 1] + a[:, 2]*a[:, 2])
+    dots = _dot3(a, V)
+    valid = norma >= 2
+    cos = np.full((c, K), np.nan)
+    cos[valid] = dots[valid] / norma[valid, None]
+    ali = decimal_round(np.abs(dots)/2, 4)
+
+    over = touching_height < an
+    damped = _damped(a, norma, ali, V)
+    full = (heights < touching_height).all(axis=1)
+    return cos, ali, damped, over, full, tri
+
+
+def lithograph_batch(triangles, normals, vectors, amin, CA,
+                     chunk_size=CHUNK_SIZE, workers=1, checkpoint=None,
+                     overhang_limit=None, shared_edges=False):
+    '''Calculating touching areas, overhangs and touching lines regarding
+    each of the K vectors, whose lowest heights amin are given.
+    Returns three arrays of length K, initialized with 1 as in Tweak.
+    With workers > 1, the chunks are examined on that many threads. The
+    partial sums are added up in chunk order afterwards, so the result is
+    bitwise the same as with one worker. checkpoint is called between the
+    chunks, see _map_chunks().
+    Of an IndexedMesh, each vertex is projected once and the facets gather
+    the heights of their vertices, unless that takes more memory than a
+    chunk, see _project_vertices().
+    With overhang_limit, an array of length K, the pass stops early as soon
+    as every overhang exceeds its limit, then the sums are partial. With
+    workers > 1 all chunks are examined anyway.
+    The touching line is the perimeter of the facets, that touch with all
+    three vertices. With shared_edges, an edge of two of them counts once,
+    see touching_line().
+    With amin None, the lowest heights are searched first, those of an
+    IndexedMesh in its projected vertices, see approach_batch().'''
+    V = np.asarray(vectors, dtype=np.float64).reshape(-1, 3).T
+    K = V.shape[1]
+    alpha = -math.cos((90-CA)*math.pi/180)
+    projected = _project_vertices(triangles, V, chunk_size, workers)
+    if amin is None:
+        amin = _lowest_heights(triangles, V, projected, chunk_size, workers)
+    touching_height = np.asarray(amin, dtype=np.float64) + 0.15
+
+    def chunk_sums(s):
+        cos, ali, damped, over, full, tri = _facet_terms(triangles, normals,
+                                              V, touching_height, s, projected)
+        sel = alpha > cos
+        bottom = sel & ~over
+        over &= sel
+        full &= bottom
+        if shared_edges:
+            line = [s.start + np.flatnonzero(full[:, k]) for k in range(K)]
+        elif full.any():
+            line = np.dot(perimeters(triangles[s] if tri is None else tri), full)
+        else:
+            line = None
+        return (np.where(bottom, ali, 0).sum(axis=0),
+                np.where(over, damped, 0).sum(axis=0), line)
+
+    bottomA = np.ones(K)
+    Overhang = np.ones(K)
+    LineL = np.ones(K)
+    touching = [list() for k in range(K)]
+    for bottom, over, line in _map_chunks(chunk_sums, len(triangles),
+                                          chunk_size, workers, checkpoint):
+        bottomA += bottom
+        Overhang += over
+        if shared_edges:
+            for k in range(K):
+                touching[k].append(line[k])
+        elif line is not None:
+            LineL += line
+        if overhang_limit is not None and (Overhang > overhang_limit).all():
+            break
+    if shared_edges:
+        for k in range(K):
+            if touching[k]:
+                LineL[k] += touching_line(triangles, np.concatenate(touching[k]))
+    return bottomA, Overhang, LineL
+
+
+def contact_lithograph_batch(tree, normals, vectors, amin, CA,
+                             chunk_size=CHUNK_SIZE, workers=1, checkpoint=None,
+                             shared_edges=False):
+    '''Calculating the same sums as lithograph_batch() with a FacetTree of
+    the mesh. One pass over the area vectors counts every selected facet
+    as overhang. The tree then returns the facets near the support plane,
+    which are moved from the overhang to the touching area, so no other
+    vertex is projected. The overhangs differ by about 1e-12 relative from
+    those of lithograph_batch(), as they are summed up in another order.'''
+    V = np.asarray(vectors, dtype=np.float64).reshape(-1, 3).T
+    K = V.shape[1]
+    alpha = -math.cos((90-CA)*math.pi/180)
+    touching_height = np.asarray(amin, dtype=np.float64) + 0.15
+
+    def terms(a):
+        norma = np.sqrt(a[:, 0]*a[:, 0] + a[:, 1]*a[:, 1] + a[:, 2]*a[:, 2])
+        dots = _dot3(a, V)
+        valid = norma >= 2
+        sel = np.zeros(dots.shape, dtype=bool)
+        sel[valid] = alpha > dots[valid] / norma[valid, None]
+        ali = decimal_round(np.abs(dots)/2, 4)
+        return sel, ali, _damped(a, norma, ali, V)
+
+    def chunk_overhang(s):
+        sel, ali, damped = terms(np.asarray(normals[s], dtype=np.float64))
+        return np.where(sel, damped, 0).sum(axis=0)
+
+    bottomA = np.ones(K)
+    Overhang = np.ones(K)
+    LineL = np.ones(K)
+    for over in _map_chunks(chunk_overhang, len(normals), chunk_size, workers,
+                            checkpoint):
+        Overhang += over
+    for k in range(K):
+        index, heights = tree.below(V[:, k], touching_height[k])
+        sel, ali, damped = terms(np.asarray(normals[index], dtype=np.float64))
+        sel = sel[:, k]
+        bottomA[k] += ali[sel, k].sum()
+        Overhang[k] -= damped[sel, k].sum()
+        full = sel & (heights < touching_height[k]).all(axis=1)
+        if shared_edges:
+            LineL[k] += touching_line(tree.triangles, index[full])
+        elif full.any():
+            LineL[k] += perimeters(tree.facets(index[full])).sum()
+    return bottomA, Overhang, LineL
+
+
+def projection_batch(triangles, normals, vectors, amin, chunk_size=CHUNK_SIZE,
+                     workers=1, checkpoint=None):
+    '''Returning a table per each of the K vectors, whose lowest heights
+    amin are given, to sum up the lithography for any critical angle. A
+    table holds the ascending cosines of the facets facing away from the
+    vector and the cumulative sums of their touching areas, overhangs and
+    touching lines, each with a leading 0. The facets selected by an angle
+    are a prefix, see threshold_sums(). The tables take 32 bytes per such
+    facet and vector. amin works as in lithograph_batch().'''
+    V = np.asarray(vectors, dtype=np.float64).reshape(-1, 3).T
+    K = V.shape[1]
+    projected = _project_vertices(triangles, V, chunk_size, workers)
+    if amin is None:
+        amin = _lowest_heights(triangles, V, projected, chunk_size, workers)
+    touching_height = np.asarray(amin, dtype=np.float64) + 0.15
+
+    def chunk_terms(s):
+        cos, ali, damped, over, full, tri = _facet_terms(triangles, normals,
+                                              V, touching_height, s, projected)
+        line = perimeters(triangles[s] if tri is None else tri)
+        terms = list()
+        for k in range(K):
+            # Critical angles up to 90 degrees only select these facets
+            sel = cos[:, k] < 0
+            terms.append((cos[sel, k], np.where(over[sel, k], 0, ali[sel, k]),
+                          np.where(over[sel, k], damped[sel, k], 0),
+                          np.where(full[sel, k], line[sel], 0)))
+        return terms
+
+    parts = list(_map_chunks(chunk_terms, len(triangles), chunk_size, workers,
+                             checkpoint))
+    tables = list()
+    for k in range(K):
+        cos, bottom, over, line = (np.concatenate([part[k][i] for part in parts])
+                                   for i in range(4))
+        order = np.argsort(cos, kind="mergesort")
+        tables.append((cos[order],) + tuple(np.concatenate(([0.0],
+                      np.cumsum(values[order]))) for values in (bottom, over, line)))
+    return tables
+
+
+def threshold_sums(tables, CA):
+    '''Returning the touching areas, overhangs and touching lines of the
+    tables of projection_batch() for the critical angle CA in degrees.
+    Returns three arrays of length K, initialized with 1 as in Tweak.'''
+    if not 0 <= CA <= 90:
+        raise ValueError("The critical angle must lie in [0, 90], got %r" % CA)
+    alpha = -math.cos((90-CA)*math.pi/180)
+    sums = np.ones((3, len(tables)))
+    for k, (cos, bottom, over, line) in enumerate(tables):
+        i = np.searchsorted(cos, alpha)
+        sums[:, k] += (bottom[i], over[i], line[i])
+    return sums[0], sums[1], sums[2]
+
+
+def score_batch(triangles, normals, vectors, CA, chunk_size=CHUNK_SIZE,
+                workers=1, shared_edges=False):
+    '''Returning touching areas, overhangs and touching lines regarding each
+    of the K vectors, see approach_batch() and lithograph_batch()'''
+    return lithograph_batch(triangles, normals, vectors, None, CA, chunk_size,
+                            workers, shared_edges=shared_edges)
+
+
+def ranking_agreement(full, proxy, keep=PROXY_KEEP):
+    '''Returning how well the proxy scores of some orientations rank them
+    like their full scores, lower being better: spearman is the rank
+    correlation, top1 tells whether both choose the same orientation and
+    recall whether the best one of the full scores is among the keep best
+    proxy scores.'''
+    full = np.asarray(full, dtype=np.float64)
+    proxy = np.asarray(proxy, dtype=np.float64)
+    n = len(full)
+    if n == 0:
+        return dict(candidates=0, spearman=1.0, top1=True, recall=True)
+    d = (np.argsort(np.argsort(full, kind="mergesort"))
+         - np.argsort(np.argsort(proxy, kind="mergesort")))
+    spearman = 1 - 6.0 * (d*d).sum() / (n * (n*n - 1)) if n > 1 else 1.0
+    best = int(np.argmin(full))
+    return dict(candidates=n, spearman=float(spearman),
+                top1=best == int(np.argmin(proxy)),
+                recall=best in np.argsort(proxy, kind="mergesort")[:keep])
+
+
+def proxy_agreement(mesh, facets, bi_algorithmic=False, CA=45,
+                    keep=PROXY_KEEP, **kwargs):
+    '''Tweaking the mesh on full resolution and scoring all its candidate
+    orientations on a proxy of about the given facets as well. Returns the
+    ranking_agreement() and the facets of the proxy. kwargs are passed to
+    ArrayTweak.
+    ArrayTweak does not score on a proxy, as decimating takes about as long
+    as the lithography of 20 to 30 orientations, more than it examines.'''
+    metrics = TweakMetrics()
+    x = ArrayTweak(mesh, bi_algorithmic, False, CA, metrics=metrics, **kwargs)
+    records = metrics.candidates
+    full = [x.target_function(r["bottomA"], r["overhang"], r["line"]) for r in records]
+    proxy = decimate(as_triangles(mesh), facets)
+    scores = score_batch(proxy, facet_normals(proxy),
+                         [r["orientation"] for r in records], CA,
+                         shared_edges=x.shared_edges)
+    result = ranking_agreement(full, [x.target_function(*side) for side in zip(*scores)],
+                               keep)
+    result["proxy_facets"] = len(proxy)
+    return result
+
+
+class ArrayTweak(Tweak):
+    """ Vectorized version of the Tweaker. Instead of a vertex list, it takes
+    the mesh as float32 or float64 array of the shape (N,3,3) or as
+    IndexedMesh, whose vertices are projected only once, as far as the
+    memory of a chunk allows, and optionally the precomputed (N,3) area
+    vectors as returned by facet_normals().
+    Both arrays stay untouched, every facet operation of Tweak is replaced by
+    a whole-array operation. All orientations are examined together in one
+    pass for the lowest heights and a second one for the lithography, see
+    approach_batch() and lithograph_batch(). chunk_size bounds the memory,
+    with workers > 1 the chunks are examined on that many threads.
+
+    candidates selects the search of promising orientations: "area" ranks
+    the area vectors of equal direction as Tweak does, "histogram" the
+    peaks of a sphere histogram, see sphere_histogram(), which suits
+    curved and scanned meshs better. "hull" takes the faces of the convex
+    hull, the mesh can rest on, weighted by their area and stability, see
+    ConvexHull.stable_poses(), which is cheap for very large meshs.
+
+    metrics, progress, cancel and seed work as in Tweak, the progress is
+    reported and the cancel token checked between the chunks. The random
+    samples of the bi-algorithmic mode are drawn from a
+    numpy.random.RandomState(seed).
+
+    With refine, a time budget in seconds, the best orientations found are
+    improved by a local search, see refine_orientations(). As the search
+    ends with the budget, its results depend on the speed of the machine.
+
+    With tree, the orientations are examined with a FacetTree of the mesh,
+    which saves projecting the vertices of all facets away from the
+    support plane, see contact_lithograph_batch().
+
+    With shared_edges, an edge shared by two touching facets counts once for
+    the touching line, instead of once in the perimeter of each facet, see
+    touching_line(). This changes the touching line and thus the results.
+
+    The attributes .Zn, .v, .phi, .R, .Unprintability, .bottomArea,
+    .overhang and .line have the same meaning as in Tweak.
+
+    Tolerance: the area vectors, their dot products and the rounded areas
+    are the same as in Tweak, see _dot3() and decimal_round(). The vertex
+    heights are matrix products, which can differ in the last bit and only
+    matter for vertices at the touching height. The sums differ by the order
+    of summation, below 1e-12 relative. Unprintability is rounded to 6
+    decimals as in Tweak and matches within 1e-6. As the best
+    orientation has to be better by 0.05, Zn and R are the same unless two
+    orientations lie within 1e-6 of that margin.
+    """
+    def __init__(self, mesh, bi_algorithmic, verbose, CA=45, n=[0,0,-1],
+                 normals=None, chunk_size=CHUNK_SIZE, workers=1, metrics=None,
+                 progress=None, cancel=None, candidates="area", seed=None,
+                 refine=0, tree=False, shared_edges=False):
+        if candidates not in CANDIDATES:
+            raise ValueError("Unknown candidates %r, use one of %s" % (candidates, CANDIDATES))
+        self.candidates = candidates
+        self.refine = refine
+        self.tree = tree
+        self.shared_edges = shared_edges
+        self._normals = normals
+        self.chunk_size = chunk_size
+        self.workers = workers
+        Tweak.__init__(self, mesh, bi_algorithmic, verbose, CA, n, metrics,
+                       progress, cancel, seed)
+
+
+    def arrange_mesh(self, mesh):
+        '''Returning the triangles and their area vectors.'''
+        tri = as_triangles(mesh)
+        normals = self._normals
+        del self._normals
+        if normals is None:
+            normals = facet_normals(tri)
+        elif np.shape(normals) != (len(tri), 3):
+            raise ValueError("Normals must have the shape (%d,3)" % len(tri))
+        return tri, np.asarray(normals, dtype=np.float64)
+
+
+    def count_facets(self, content):
+        return len(content[0])
+
+
+    def chunk_checkpoint(self, phase):
+        '''Returning the checkpoint for the chunks of phase, if needed'''
+        if self.progress is None and self.cancel is None:
+            return None
+        return lambda done, total: self.checkpoint(phase, done, total)
+
+
+    def approachfirstvertex(self, content):
+        '''Returning the lowest z value'''
+        if isinstance(content[0], IndexedMesh):
+            return float(content[0].vertices[:, 2].min())
+        return float(content[0][..., 2].min())
+
+
+    def approachvertex(self, content, n):
+        '''Returning the lowest value regarding vector n'''
+        return float(approach_batch(content[0], n, self.chunk_size,
+                     self.workers, self.chunk_checkpoint("approachvertex"))[0])
+
+
+    def lithograph(self, content, n, amin, CA):
+        '''Calculating touching areas and overhangs regarding the vector n'''
+        bottomA, Overhang, LineL = lithograph_batch(content[0], content[1], n,
+                                       [amin], CA, self.chunk_size, self.workers,
+                                       self.chunk_checkpoint("lithograph"),
+                                       shared_edges=self.shared_edges)
+        return float(bottomA[0]), float(Overhang[0]), float(LineL[0])
+
+
+    def evaluate_orientations(self, content, orientations, CA):
+        '''Calculating touching area, overhang and touching line of all
+        orientations at once'''
+        if len(orientations) == 0:
+            return list()
+        vectors = [[float("{:6f}".format(-i)) for i in side[0]]
+                   for side in orientations]
+        if self.tree:
+            with self.metrics.phase("facet_tree"):
+                tree = FacetTree(content[0])
+                amin = tree.min_heights(vectors)
+            with self.metrics.phase("contact_lithograph_batch"):
+                bottomA, Overhang, LineL = contact_lithograph_batch(tree,
+                               content[1], vectors, amin, CA, self.chunk_size,
+                               self.workers, self.chunk_checkpoint("contact_lithograph_batch"),
+                               self.shared_edges)
+        else:
+            # The vertices of an IndexedMesh are projected only once
+            amin = None
+            if not isinstance(content[0], IndexedMesh):
+                with self.metrics.phase("approach_batch"):
+                    amin = approach_batch(content[0], vectors, self.chunk_size,
+                                 self.workers, self.chunk_checkpoint("approach_batch"))
+            with self.metrics.phase("lithograph_batch"):
+                bottomA, Overhang, LineL = lithograph_batch(content[0], content[1],
+                               vectors, amin, CA, self.chunk_size, self.workers,
+                               self.chunk_checkpoint("lithograph_batch"),
+                               shared_edges=self.shared_edges)
+        liste = [[vectors[k], float(bottomA[k]), float(Overhang[k]),
+                  float(LineL[k])] for k in range(len(vectors))]
+        # The passes examine all orientations at once, so there are no
+        # timings per orientation
+        for orientation, bottom, over, line in liste:
+            self.metrics.candidate(orientation, bottom, over, line)
+        self.metrics.count("facets_processed", 2 * len(content[0]) * len(vectors))
+        return liste
+
+
+    def refine_orientations(self, content, liste, CA):
+        '''Searching better orientations around the REFINE_STARTS best ones
+        of liste by a pattern search on the sphere, for about refine
+        seconds. Each round examines the four neighbours of every start at
+        its step in one pass, in two directions orthogonal to it. A start
+        moves to its best neighbour, if that one is better, otherwise its
+        step is halved down to REFINE_MIN_STEP. Neighbours are only better,
+        if their overhang alone stays below the unprintability of the start,
+        so the pass stops early, once every overhang exceeds that limit.
+        Returns the final orientation of every start, that moved.'''
+        if not self.refine or not liste:
+            return list()
+        stime = time.time()
+        scores = [self.target_function(*side[1:]) for side in liste]
+        starts = list()
+        for k in sorted(range(len(liste)), key=lambda k: scores[k]):
+            if len(starts) < REFINE_STARTS and liste[k][0] not in [side[0] for side in starts]:
+                starts.append(liste[k])
+        F = [scores[liste.index(side)] for side in starts]
+        steps = [REFINE_STEP] * len(starts)
+        moved = [False] * len(starts)
+        evaluations = 0
+
+        while time.time() - stime < self.refine:
+            active = [i for i in range(len(starts)) if steps[i] >= REFINE_MIN_STEP]
+            if not active:
+                break
+            self.checkpoint("refine_orientations", time.time() - stime, self.refine)
+            vectors = list()
+            owners = list()
+            for i in active:
+                p = np.array(starts[i][0], dtype=np.float64)
+                u = np.cross(p, np.eye(3)[np.argmin(np.abs(p))])
+                u /= np.linalg.norm(u)
+                w = np.cross(p, u)
+                for d in (u, -u, w, -w):
+                    v = p + steps[i] * d
+                    vectors.append([float("{:6f}".format(x)) for x in v / np.linalg.norm(v)])
+                    owners.append(i)
+            bottomA, Overhang, LineL = lithograph_batch(content[0], content[1],
+                vectors, None, CA, self.chunk_size, self.workers,
+                self.chunk_checkpoint("refine_orientations"),
+                np.array([F[i] for i in owners]) * self.ABSLIMIT,
+                self.shared_edges)
+            evaluations += len(vectors)
+
+            # Partial sums of an early stop make every neighbour worse
+            best = dict()
+            for k, i in enumerate(owners):
+                score = self.target_function(bottomA[k], Overhang[k], LineL[k])
+                if score < F[i] and (i not in best or score < best[i][0]):
+                    best[i] = (score, [vectors[k], float(bottomA[k]),
+                                       float(Overhang[k]), float(LineL[k])])
+            for i in active:
+                if i in best:
+                    F[i], starts[i] = best[i]
+                    moved[i] = True
+                else:
+                    steps[i] /= 2
+        self.metrics.count("refine_evaluations", evaluations)
+        return [side for side, m in zip(starts, moved) if m]
+
+
+    def area_cumulation(self, content, n):
+        '''Searching best options out of the objects area vector field'''
+        if self.bi_algorithmic: best_n = 7
+        else: best_n = 5
+        if self.candidates == "histogram":
+            return [[[0.0,0.0,1.0], 0.0]] + sphere_histogram(content[1], best_n)
+        if self.candidates == "hull":
+            try:
+                return [[[0.0,0.0,1.0], 0.0]] + stable_poses(content[0], best_n)
+            except ValueError:  # Flat meshs have no hull, their area is ranked
+                pass
+        a = content[1]
+        A = np.sqrt(a[:, 0]*a[:, 0] + a[:, 1]*a[:, 1] + a[:, 2]*a[:, 2])
+        valid = A > 0
+        if not valid.any():
+            return [[[0.0,0.0,1.0], 0.0]]
+        keys, first, inverse = np.unique(direction_keys(a[valid] / A[valid, None]),
+                                         return_index=True, return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=A[valid])
+        # Ties are ranked by first occurrence, like Counter.most_common
+        top = np.lexsort((first, -sums))[:best_n]
+        return [[[0.0,0.0,1.0], 0.0]] + [[key_direction(keys[i]),
+                float("{:2f}".format(sums[i]))] for i in top]
+
+
+    def egde_plus_vertex(self, mesh, best_n):
+        '''Searching normals or random edges with one vertice. All samples
+        of a chunk are drawn and crossed at once, the normals are rounded
+        to keys and counted with np.unique.'''
+        tri = as_triangles(mesh)
+        vcount = 3 * len(tri)
+        # Small files need more calculations
+        if vcount < 10000: it = 5
+        elif vcount < 25000: it = 2
+        else: it = 1
+        rand = np.random.RandomState(self.seed)
+        normals = list()
+        for s in _chunks(vcount * it, self.chunk_size):
+            self.checkpoint("egde_plus_vertex", s.start, vcount * it)
+            i = np.arange(s.start, s.stop) % vcount
+            # Each vertex spans an edge with the next vertex of its facet
+            j = i - i % 3 + (i % 3 + 1) % 3
+            r = corners(tri, rand.randint(0, vcount, len(i)))
+            v = corners(tri, i) - r
+            w = corners(tri, j) - r
+            a = np.stack((v[:, 1]*w[:, 2] - v[:, 2]*w[:, 1],
+                          v[:, 2]*w[:, 0] - v[:, 0]*w[:, 2],
+                          v[:, 0]*w[:, 1] - v[:, 1]*w[:, 0]), axis=1)
+            n = np.sqrt(a[:, 0]*a[:, 0] + a[:, 1]*a[:, 1] + a[:, 2]*a[:, 2])
+            valid = n != 0
+            normals.append(direction_keys(a[valid] / n[valid, None]))
+        normals = np.concatenate(normals) if normals else np.zeros(0, np.int64)
+        if len(normals) == 0:
+            return list()
+        keys, first, counts = np.unique(normals, return_index=True,
+                                        return_counts=True)
+        # Ties are ranked by first occurrence, like Counter.most_common
+        top = np.lexsort((first, -counts))[:best_n]
+        return [[key_direction(keys[k]), int(counts[k])] for k in top if counts[k] > 2]
+
+
+class OrientationAnalysis(ArrayTweak):
+    """ ArrayTweak, that keeps the lithography of every examined orientation
+    as tables of projection_batch() instead of the sums for one critical
+    angle. retweak() chooses the best orientation again for another
+    critical angle or other weights of the target function, without
+    loading the mesh, searching orientations or projecting any facet:
+
+        x = OrientationAnalysis(mesh, False, False, 45)
+        for CA in (30, 40, 50):
+            print(CA, x.retweak(CA).Zn)
+
+    The sums of the tables are added up in another order than those of
+    lithograph_batch(), so they differ by about 1e-12 relative. The tables
+    sum up perimeters, so shared_edges is not supported. Neither is tree,
+    as every orientation is kept for any critical angle.
+    """
+    def __init__(self, mesh, bi_algorithmic, verbose, CA=45, n=[0,0,-1],
+                 **kwargs):
+        for name in ("tree", "shared_edges"):
+            if kwargs.get(name):
+                raise ValueError("OrientationAnalysis does not support %s" % name)
+        self.CA = CA
+        ArrayTweak.__init__(self, mesh, bi_algorithmic, verbose, CA, n, **kwargs)
+
+
+    def evaluate_orientations(self, content, orientations, CA):
+        '''Projecting all facets onto the initial and all further
+        orientations once and summing up the lithography for CA'''
+        # The initial orientation is examined by lithograph() with [0,0,1]
+        self.vectors = [[0.0,0.0,1.0]] + [[float("{:6f}".format(-i)) for i in side[0]]
+                                          for side in orientations]
+        amin = None
+        if not isinstance(content[0], IndexedMesh):
+            with self.metrics.phase("approach_batch"):
+                amin = approach_batch(content[0], self.vectors, self.chunk_size,
+                             self.workers, self.chunk_checkpoint("approach_batch"))
+        with self.metrics.phase("projection_batch"):
+            self.tables = projection_batch(content[0], content[1], self.vectors,
+                             amin, self.chunk_size, self.workers,
+                             self.chunk_checkpoint("projection_batch"))
+        liste = self.evaluate(CA)[1:]
+        for orientation, bottom, over, line in liste:
+            self.metrics.candidate(orientation, bottom, over, line)
+        self.metrics.count("facets_processed", 2 * len(content[0]) * len(liste))
+        return liste
+
+
+    def refine_orientations(self, content, liste, CA):
+        '''Adding the tables of the refined orientations, so retweak()
+        takes them into account as well'''
+        refined = ArrayTweak.refine_orientations(self, content, liste, CA)
+        if not refined:
+            return refined
+        vectors = [side[0] for side in refined]
+        self.tables += projection_batch(content[0], content[1], vectors, None,
+                                        self.chunk_size, self.workers)
+        self.vectors += vectors
+        return self.evaluate(CA)[-len(vectors):]
+
+
+    def evaluate(self, CA):
+        '''Returning touching area, overhang and touching line of the
+        initial and all further orientations for the critical angle CA'''
+        bottomA, Overhang, LineL = threshold_sums(self.tables, CA)
+        return [[self.vectors[k], float(bottomA[k]), float(Overhang[k]),
+                 float(LineL[k])] for k in range(len(self.vectors))]
+
+
+    def retweak(self, CA=None, verbose=False, **weights):
+        '''Choosing the best orientation for the critical angle CA and the
+        weights ABSLIMIT, RELLIMIT and LINE_FAKTOR of target_function().
+        Omitted ones keep their last value. Sets the result attributes like
+        the constructor does and returns the OrientationAnalysis.'''
+        for name, value in weights.items():
+            if name not in ("ABSLIMIT", "RELLIMIT", "LINE_FAKTOR"):
+                raise TypeError("Unknown weight %r" % name)
+            setattr(self, name, value)
+        if CA is not None:
+            self.CA = CA
+        Unprintability, bestside = self.best_orientation(self.evaluate(self.CA),
+                                                         verbose)
+        self.set_result(Unprintability, bestside)
+        return self
@@ -0,0 +1,184 @@
+# Python 3.9
+# Tweaking many files at once, spread over a pool of processes.
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from ArrayTweaker import ArrayTweak, as_triangles
+from IndexedMesh import IndexedMesh
+from FileHandler import FileHandler
+from ResultCache import ResultCache
+
+SUPPORTED = (".stl", ".3mf")
+
+
+def find_files(directory):
+    '''Returning the supported mesh files of a directory, sorted by name'''
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if os.path.splitext(name)[1].lower() in SUPPORTED]
+
+
+def tweak_files(paths, workers=None, bi_algorithmic=False, CA=45,
+                outdir=None, binary=False, cache=None):
+    '''Tweaking all objects of the given files in a pool of worker processes.
+    A worker loads a file on its own. If it contains several objects, like
+    3MF files may do, all of them are put into shared memory and tweaked by
+    any worker, so no mesh is ever pickled.
+    One dict per object is yielded in the order of completion. It has the
+    keys file, object, objects, facets, time, error and, without error,
+    the results Zn, v, phi, R, Unprintability, bottomArea, overhang, line.
+    With outdir, the tweaked objects are saved there as STL files. cache is
+    the path of a ResultCache, that the workers share.'''
+    workers = workers or os.cpu_count() or 1
+    options = dict(bi_algorithmic=bi_algorithmic, CA=CA, outdir=outdir,
+                   binary=binary, cache=cache)
+    # Workers create the shared blocks, which are unlinked here. Both have
+    # to use the same resource tracker, so it is started before forking.
+    resource_tracker.ensure_running()
+
+    jobs = deque((path, 0, 1, None) for path in paths)
+    running = dict()
+    pool = ProcessPoolExecutor(workers)
+    try:
+        while jobs or running:
+            # Only few jobs are submitted at once, to bound the shared memory
+            while jobs and len(running) < 2 * workers:
+                job = jobs.popleft()
+                running[pool.submit(_tweak_job, job, options)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                job = running.pop(future)
+                try:
+                    results, shares = future.result()
+                except Exception as e:
+                    broken = broken or isinstance(e, BrokenProcessPool)
+                    results, shares = [_failure(job, e)], []
+                finally:
+                    _unlink(job[3])
+                jobs.extend(shares)
+                for result in results:
+                    yield result
+            if broken:
+                # A crashed worker takes the pool down, go on with a new one
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(workers)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        for job in list(jobs) + list(running.values()):
+            _unlink(job[3])
+
+
+def _tweak_job(job, options):
+    '''Tweaking the object of a job in a worker process. Jobs are tuples of
+    (path, object index, object count, shared blocks). Returns the results
+    and the jobs for further objects found in the file.'''
+    path, index, count, blocks = job
+    if blocks is not None:
+        shms = [SharedMemory(name=block[0]) for block in blocks]
+        try:
+            arrays = [np.ndarray(block[1], dtype=block[2], buffer=shm.buf)
+                      for block, shm in zip(blocks, shms)]
+            mesh = IndexedMesh(*arrays) if len(arrays) == 2 else arrays[0]
+            result = tweak_object(path, index, count, mesh, options)
+            del mesh, arrays
+        finally:
+            for shm in shms:
+                shm.close()
+        return [result], []
+
+    objs = FileHandler().loadMesh(path, arrays=True)
+    if not objs:
+        raise ValueError("No objects found in %s" % path)
+    if len(objs) == 1:
+        return [tweak_object(path, 0, 1, objs[0]["Mesh"], options)], []
+    # The objects of a file with several ones are all shared, so the workers
+    # tweak them at once. Blocks are released on any failure.
+    results = list()
+    shares = list()
+    try:
+        for i, obj in enumerate(objs):
+            try:
+                shares.append((path, i, len(objs), _share(obj["Mesh"])))
+            except Exception as e:
+                results.append(_failure((path, i, len(objs), None), e))
+    except BaseException:
+        for job in shares:
+            _unlink(job[3])
+        raise
+    return results, shares
+
+
+def tweak_object(path, index, count, mesh, options):
+    '''Tweaking one object of a file and returning the result dict.
+    options holds bi_algorithmic, CA, outdir, binary and cache as given to
+    tweak_files.'''
+    stime = time.time()
+    mesh = as_triangles(mesh)
+    if options["cache"]:
+        x = open_cache(options["cache"]).tweak(mesh, options["bi_algorithmic"],
+                                                options["CA"], ArrayTweak)
+    else:
+        x = ArrayTweak(mesh, options["bi_algorithmic"], False, options["CA"])
+    if options["outdir"]:
+        name = os.path.splitext(os.path.basename(path))[0] + "_tweaked"
+        if count > 1:
+            name += " ({})".format(index)
+        FileHandler().writeSTL(x.R, mesh, os.path.join(options["outdir"], name + ".stl"),
+                               path, binary=options["binary"])
+    return dict(file=path, object=index, objects=count, facets=len(mesh),
+                time=time.time() - stime, error=None, Zn=x.Zn, v=x.v,
+                phi=x.phi, R=x.R, Unprintability=x.Unprintability,
+                bottomArea=x.bottomArea, overhang=x.overhang, line=x.line)
+
+
+_caches = dict()
+
+def open_cache(path):
+    '''Returning the ResultCache of this worker process'''
+    if path not in _caches:
+        _caches[path] = ResultCache(path)
+    return _caches[path]
+
+
+def _failure(job, e):
+    return dict(file=job[0], object=job[1], objects=job[2], facets=None,
+                time=None, error="%s: %s" % (type(e).__name__, e))
+
+
+def _share(mesh):
+    '''Copying a mesh into new shared memory blocks, the vertices and
+    faces of an IndexedMesh into one block each. Returns the name, shape
+    and dtype of every block.'''
+    mesh = as_triangles(mesh)
+    if isinstance(mesh, IndexedMesh):
+        arrays = [mesh.vertices, mesh.faces]
+    else:
+        arrays = [np.asarray(mesh)]
+    blocks = list()
+    try:
+        for array in arrays:
+            shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append((shm.name, array.shape, array.dtype.str))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            shm.close()
+    except BaseException:
+        _unlink(blocks)
+        raise
+    return blocks
+
+
+def _unlink(blocks):
+    for block in blocks or ():
+        try:
+            shm = SharedMemory(name=block[0])
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
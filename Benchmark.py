@@ -0,0 +1,303 @@
+# Python 3.5
+# Benchmark of the load, tweak and write phases on synthetic and real meshes.
+#
+# python Benchmark.py -s 1000,100000 -o bench.json
+# python Benchmark.py -s 1000,100000 --baseline bench.json
+# compares a new run with a stored one and exits with 1 on regressions.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+from ArrayTweaker import ArrayTweak, as_triangles, facet_normals, proxy_agreement
+from FileHandler import FileHandler
+from MeshTweaker import TweakMetrics
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+SHAPES = ("sphere", "cylinder", "death_star", "noisy_scan")
+PHASES = ("load", "tweak", "write")
+# The sizes of the synthetic shapes are given for this many facets. They
+# grow with the square root of the facets, so the mean facet area stays the
+# same. Tweak skips facets with an area below 1.
+SCALE_FACETS = 1000.0
+
+
+def grid_mesh(points):
+    '''Triangulating a (rows, cols, 3) grid of points, that is closed in the
+    second direction. Rows of identical points, like poles, are allowed.'''
+    rows, cols = points.shape[:2]
+    i, j = np.meshgrid(np.arange(rows - 1), np.arange(cols), indexing="ij")
+    a = points[i, j]
+    b = points[i + 1, j]
+    c = points[i + 1, (j + 1) % cols]
+    d = points[i, (j + 1) % cols]
+    first = np.stack((a, b, c), axis=-2).reshape(-1, 3, 3)
+    second = np.stack((a, c, d), axis=-2).reshape(-1, 3, 3)
+    return np.concatenate((first, second))
+
+
+def scale(facets):
+    '''Returning the factor of the shape sizes, see SCALE_FACETS'''
+    return np.sqrt(facets / SCALE_FACETS)
+
+
+def _sphere_points(facets, radius=20.0):
+    radius *= scale(facets)
+    rows = max(int(np.sqrt(facets / 4.0)), 2)
+    theta = np.linspace(0, np.pi, rows + 1)[:, None]
+    phi = np.linspace(0, 2 * np.pi, 2 * rows, endpoint=False)[None, :]
+    return radius * np.stack((np.sin(theta) * np.cos(phi),
+                              np.sin(theta) * np.sin(phi),
+                              np.cos(theta) * np.ones_like(phi)), axis=-1)
+
+
+def sphere(facets):
+    '''UV sphere with about the given number of facets'''
+    return grid_mesh(_sphere_points(facets))
+
+
+def cylinder(facets, radius=10.0, height=40.0):
+    '''Closed cylinder with about the given number of facets. The flat
+    bottom and top are rings of zero width towards the axis.'''
+    radius *= scale(facets)
+    height *= scale(facets)
+    cols = max(int(np.sqrt(facets * 2.0)), 3)
+    rows = max(facets // (2 * cols) - 2, 1)
+    phi = np.linspace(0, 2 * np.pi, cols, endpoint=False)
+    z = np.concatenate(([0.0], np.linspace(0, height, rows + 1), [height]))
+    r = np.concatenate(([0.0], np.full(rows + 1, radius), [0.0]))
+    points = np.stack((r[:, None] * np.cos(phi), r[:, None] * np.sin(phi),
+                       z[:, None] * np.ones_like(phi)), axis=-1)
+    return grid_mesh(points[::-1])
+
+
+def death_star(facets, radius=20.0):
+    '''Sphere with a concave dish, like the death star demo object'''
+    points = _sphere_points(facets, radius)
+    radius *= scale(facets)
+    axis = np.array([0.6, 0.0, 0.8])
+    cos = points.dot(axis) / radius
+    dish = cos > 0.9
+    # Vertices inside the dish are pressed onto a sphere around the rim
+    centre = axis * radius * 1.3
+    inner = points[dish] - centre
+    inner *= (radius * 0.65) / np.linalg.norm(inner, axis=-1)[:, None]
+    points[dish] = centre + inner
+    return grid_mesh(points)
+
+
+def noisy_scan(facets, radius=20.0, noise=0.2, seed=1):
+    '''Sphere with radial noise on every vertex, like a 3D scan'''
+    points = _sphere_points(facets, radius)
+    rng = np.random.RandomState(seed)
+    noisy = 1 + rng.uniform(-noise, noise, points.shape[:2]) / radius
+    noisy[0] = noisy[-1] = 1  # Keep the poles closed
+    return grid_mesh(points * noisy[..., None])
+
+
+def peak_rss_reset():
+    '''Resetting the peak resident memory, if the system supports it'''
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def peak_rss():
+    '''Returning the peak resident memory in MB'''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 ** (2 if sys.platform == "darwin" else 1)
+
+
+def run_case(name, path, bi_algorithmic=False, CA=45, workers=1, repeat=1,
+             proxy=None):
+    '''Running load, tweak and write on a file. Returns the record of the
+    case with the best time of each phase over repeat runs, along with the
+    TweakMetrics phases and counts of the fastest tweak. With proxy, the
+    record holds the proxy_agreement() of the candidates scored on a proxy
+    of that many facets, which is not part of the timings.
+    A ValueError is raised for meshs without any facet Tweak scores, whose
+    timings would mean nothing.'''
+    phases = dict()
+    metrics = None
+    agreement = None
+    handler = FileHandler()
+    outfile = os.path.join(tempfile.gettempdir(), "tweaker_benchmark_out.stl")
+    for _ in range(repeat):
+        timings = dict()
+
+        peak_rss_reset()
+        stime = time.time()
+        mesh = as_triangles(handler.loadMesh(path, arrays=True)[0]["Mesh"])
+        facets = len(mesh)
+        timings["load"] = (time.time() - stime, peak_rss())
+        if "load" not in phases:
+            normals = facet_normals(mesh)
+            scored = float(np.mean(np.sqrt((normals * normals).sum(axis=1)) >= 2))
+            del normals
+            if scored == 0:
+                raise ValueError("No facet of %s is scored, the facet areas are below 1" % name)
+
+        peak_rss_reset()
+        stime = time.time()
+        run_metrics = TweakMetrics()
+        x = ArrayTweak(mesh, bi_algorithmic, False, CA, workers=workers,
+                       metrics=run_metrics)
+        timings["tweak"] = (time.time() - stime, peak_rss())
+        if "tweak" not in phases or timings["tweak"][0] < phases["tweak"]["time"]:
+            metrics = run_metrics.as_dict()
+
+        peak_rss_reset()
+        stime = time.time()
+        handler.writeSTL(x.R, mesh, outfile, name, binary=True)
+        timings["write"] = (time.time() - stime, peak_rss())
+
+        for phase, (seconds, rss) in timings.items():
+            if phase not in phases or seconds < phases[phase]["time"]:
+                phases[phase] = dict(time=seconds, peak_rss_mb=round(rss, 1),
+                                     facets_per_s=facets / max(seconds, 1e-9))
+        if proxy and agreement is None:
+            agreement = proxy_agreement(mesh, proxy, bi_algorithmic, CA,
+                                        workers=workers)
+        del mesh
+    os.remove(outfile)
+    return dict(mesh=name, facets=facets, phases=phases,
+                tweak_phases=metrics["phases"], counts=metrics["counts"],
+                scored=scored, Unprintability=x.Unprintability,
+                proxy_agreement=agreement)
+
+
+def run(sizes, shapes=SHAPES, stl_dir=None, bi_algorithmic=False, CA=45,
+        workers=1, repeat=1, verbose=False, proxy=None):
+    '''Benchmarking the synthetic shapes in all sizes and the STL files of
+    stl_dir. Returns the report as dict.'''
+    results = list()
+    cases = list()
+    tmpdir = tempfile.mkdtemp(prefix="tweaker_benchmark_")
+    for shape in shapes:
+        for size in sizes:
+            cases.append(("%s_%d" % (shape, size), shape, size))
+    if stl_dir:
+        for name in sorted(os.listdir(stl_dir)):
+            if name.lower().endswith(".stl"):
+                cases.append((name, None, os.path.join(stl_dir, name)))
+
+    for name, shape, source in cases:
+        if shape is None:
+            path = source
+        else:
+            # Synthetic meshes are written to disk first, to also time loading
+            path = os.path.join(tmpdir, name + ".stl")
+            FileHandler().writeSTL(np.eye(3), globals()[shape](source), path,
+                                   name, binary=True)
+        result = run_case(name, path, bi_algorithmic, CA, workers, repeat, proxy)
+        if shape is not None:
+            os.remove(path)
+        results.append(result)
+        if verbose:
+            print("  %-28s %9d facets " % (name, result["facets"]) + "".join(
+                "%s %8.3f s  " % (phase, result["phases"][phase]["time"])
+                for phase in PHASES))
+            if result["proxy_agreement"]:
+                print("  %-28s proxy of %d facets: spearman %.3f, top1 %s, recall %s" % (
+                      "", result["proxy_agreement"]["proxy_facets"],
+                      result["proxy_agreement"]["spearman"],
+                      result["proxy_agreement"]["top1"], result["proxy_agreement"]["recall"]))
+    os.rmdir(tmpdir)
+    return dict(meta=dict(time=time.strftime("%Y-%m-%d %H:%M:%S"),
+                          python=platform.python_version(),
+                          numpy=np.__version__, machine=platform.machine(),
+                          processor=platform.processor(), workers=workers,
+                          bi_algorithmic=bi_algorithmic, CA=CA, proxy=proxy),
+                results=results)
+
+
+def compare(report, baseline, threshold=0.2, min_delta=0.01):
+    '''Returning the regressions of report against baseline: all phases of
+    meshs in both reports, that are slower by more than threshold and by
+    more than min_delta seconds, which hides the noise of tiny meshs.'''
+    old = dict((res["mesh"], res) for res in baseline["results"])
+    regressions = list()
+    for res in report["results"]:
+        if res["mesh"] not in old:
+            continue
+        for phase in PHASES:
+            before = old[res["mesh"]]["phases"].get(phase)
+            after = res["phases"].get(phase)
+            if (before and after and after["time"] > before["time"] * (1 + threshold)
+                    and after["time"] - before["time"] > min_delta):
+                regressions.append(dict(mesh=res["mesh"], phase=phase,
+                                        before=before["time"], after=after["time"],
+                                        ratio=after["time"] / max(before["time"], 1e-9)))
+    return regressions
+
+
+def getargs():
+    parser = argparse.ArgumentParser(description=
+            "Benchmark of the Tweaker on synthetic and real meshes")
+    parser.add_argument('-s', '--sizes', action="store", dest="sizes", default=DEFAULT_SIZES,
+                        help="comma separated facet counts of the synthetic meshs")
+    parser.add_argument('--shapes', action="store", dest="shapes", default=",".join(SHAPES),
+                        help="comma separated synthetic shapes, out of %s" % ", ".join(SHAPES))
+    parser.add_argument('-d', '--dir', action="store", dest="stl_dir", default=None,
+                        help="also benchmark the STL files of this directory, e.g. STLs")
+    parser.add_argument('-a', '--angle', action="store", dest="angle", type=int, default=45,
+                        help="critical angle for overhang demarcation in degrees")
+    parser.add_argument('-b', '--bi', action="store_true", dest="bi_algorithmic", default=False,
+                        help="using two algorithms for calculation")
+    parser.add_argument('-w', '--workers', action="store", dest="workers", type=int, default=1,
+                        help="number of threads for the lithography")
+    parser.add_argument('-p', '--proxy', action="store", dest="proxy", type=int, default=None,
+                        help="also score the candidates on a proxy of this many facets "
+                        "and report how well it ranks them")
+    parser.add_argument('-n', '--repeat', action="store", dest="repeat", type=int, default=1,
+                        help="runs per mesh, the best time counts")
+    parser.add_argument('-o', action="store", dest="outputfile", default=None,
+                        help="save the report as JSON in this file")
+    parser.add_argument('--baseline', action="store", dest="baseline", default=None,
+                        help="compare with the report in this JSON file")
+    parser.add_argument('-t', '--threshold', action="store", dest="threshold", type=float,
+                        default=0.2, help="relative slowdown, that counts as regression")
+    parser.add_argument('--min-delta', action="store", dest="min_delta", type=float,
+                        default=0.01, help="slowdown in seconds, below which nothing counts as regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = getargs()
+    sizes = [int(float(size)) for size in args.sizes.split(",") if size]
+    shapes = [shape for shape in args.shapes.split(",") if shape]
+    for shape in shapes:
+        if shape not in SHAPES:
+            print("Unknown shape %s" % shape)
+            sys.exit(2)
+
+    report = run(sizes, shapes, args.stl_dir, args.bi_algorithmic, args.angle,
+                 args.workers, args.repeat, verbose=True, proxy=args.proxy)
+    if args.outputfile:
+        with open(args.outputfile, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_delta)
+        for reg in regressions:
+            print("Regression: %-28s %-6s %8.3f s -> %8.3f s (x%.2f)" % (reg["mesh"],
+                  reg["phase"], reg["before"], reg["after"], reg["ratio"]))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against %s" % args.baseline)
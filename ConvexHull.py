@@ -0,0 +1,244 @@
+# Python 2.7 and 3.5
+# Convex hull of a mesh and the stable resting poses on its faces.
+
+import math
+import numpy as np
+from IndexedMesh import IndexedMesh
+
+# Adjacent hull facets, whose normals differ less, form one face
+MERGE_ANGLE = 1.0
+# Directions, whose extreme vertices span the hull of stable_poses()
+HULL_DIRECTIONS = 512
+
+
+def convex_hull(points, eps=None):
+    '''Returning the (H,3) vertex indices of the facets of the convex hull of
+    (M,3) points by quickhull, each facet counterclockwise seen from the
+    outside. Points closer than eps to a facet count as inside, eps
+    defaults to 1e-9 of the extent of the points. Raises ValueError, if
+    all points lie in a plane.'''
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(pts) < 4:
+        raise ValueError("The convex hull needs at least 4 points")
+    extent = float((pts.max(axis=0) - pts.min(axis=0)).max())
+    if eps is None:
+        eps = 1e-9 * extent
+
+    # Initial simplex of extreme points
+    axis = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+    a, b = int(np.argmin(pts[:, axis])), int(np.argmax(pts[:, axis]))
+    line = pts[b] - pts[a]
+    cross = np.cross(pts - pts[a], line)
+    c = int(np.argmax((cross * cross).sum(axis=1)))
+    normal = np.cross(pts[b] - pts[a], pts[c] - pts[a])
+    height = np.dot(pts - pts[a], normal)
+    d = int(np.argmax(np.abs(height)))
+    if abs(height[d]) <= eps * np.linalg.norm(normal) or np.linalg.norm(normal) == 0:
+        raise ValueError("All points lie in a plane, the mesh has no volume")
+    if height[d] > 0:
+        b, c = c, b
+
+    faces = dict()      # id: [vertices, normal, offset, outside points]
+    edges = dict()      # directed edge: id of its facet
+    count = [0]
+
+    def add_faces(triples):
+        '''Adding the facets of the vertex triples, returns their ids'''
+        t = np.array(triples, dtype=np.int64).reshape(-1, 3)
+        u = pts[t[:, 1]] - pts[t[:, 0]]
+        v = pts[t[:, 2]] - pts[t[:, 0]]
+        N = np.stack((u[:, 1]*v[:, 2] - u[:, 2]*v[:, 1], u[:, 2]*v[:, 0] - u[:, 0]*v[:, 2],
+                      u[:, 0]*v[:, 1] - u[:, 1]*v[:, 0]), axis=1)
+        N /= np.maximum(np.sqrt((N * N).sum(axis=1)), 1e-300)[:, None]
+        off = (N * pts[t[:, 0]]).sum(axis=1)
+        ids = list()
+        for (i, j, k), n, o in zip(triples, N, off.tolist()):
+            faces[count[0]] = [(i, j, k), n, o, None]
+            for edge in ((i, j), (j, k), (k, i)):
+                edges[edge] = count[0]
+            ids.append(count[0])
+            count[0] += 1
+        return ids
+
+    def assign(ids, candidates):
+        '''Assigning each outside point to the facet, it is farthest from'''
+        if len(candidates) == 0:
+            for f in ids:
+                faces[f][3] = candidates
+            return
+        N = np.array([faces[f][1] for f in ids])
+        off = np.array([faces[f][2] for f in ids])
+        dist = np.dot(pts[candidates], N.T) - off
+        best = dist.argmax(axis=1)
+        outside = dist[np.arange(len(candidates)), best] > eps
+        for k, f in enumerate(ids):
+            faces[f][3] = candidates[outside & (best == k)]
+
+    ids = add_faces([(a, b, c), (a, d, b), (b, d, c), (c, d, a)])
+    assign(ids, np.arange(len(pts)))
+    pending = [f for f in ids if len(faces[f][3])]
+
+    while pending:
+        f = pending.pop()
+        if f not in faces or len(faces[f][3]) == 0:
+            continue
+        outside = faces[f][3]
+        p = int(outside[np.argmax(np.dot(pts[outside], faces[f][1]))])
+
+        # The facets visible from p form a connected region around f
+        visible = set([f])
+        stack = [f]
+        while stack:
+            g = stack.pop()
+            i, j, k = faces[g][0]
+            for edge in ((j, i), (k, j), (i, k)):
+                h = edges.get(edge)
+                if h is not None and h not in visible and \
+                        np.dot(faces[h][1], pts[p]) - faces[h][2] > eps:
+                    visible.add(h)
+                    stack.append(h)
+        horizon = list()
+        candidates = list()
+        for g in visible:
+            i, j, k = faces[g][0]
+            for edge in ((i, j), (j, k), (k, i)):
+                if edges.get((edge[1], edge[0])) not in visible:
+                    horizon.append(edge)
+            candidates.append(faces[g][3])
+        for g in visible:
+            i, j, k = faces[g][0]
+            for edge in ((i, j), (j, k), (k, i)):
+                if edges.get(edge) == g:
+                    del edges[edge]
+            del faces[g]
+
+        ids = add_faces([(i, j, p) for i, j in horizon])
+        candidates = np.concatenate(candidates)
+        assign(ids, candidates[candidates != p])
+        pending += [g for g in ids if len(faces[g][3])]
+
+    return np.array([faces[f][0] for f in sorted(faces)], dtype=np.int64).reshape(-1, 3)
+
+
+def sphere_directions(count):
+    '''Returning count evenly spread unit vectors of a Fibonacci lattice'''
+    i = np.arange(count) + 0.5
+    z = 1 - 2 * i / count
+    r = np.sqrt(1 - z * z)
+    phi = math.pi * (3 - math.sqrt(5)) * i
+    return np.stack((r * np.cos(phi), r * np.sin(phi), z), axis=1)
+
+
+def extreme_points(points, directions, chunk_size=1 << 14):
+    '''Returning the ascending indices of the points, that lie farthest
+    along any of the directions. All of them are vertices of the convex
+    hull, so their hull is an inner approximation of the one of points.'''
+    best = np.full(len(directions), -np.inf)
+    index = np.zeros(len(directions), dtype=np.int64)
+    for start in range(0, len(points), chunk_size):
+        heights = np.dot(directions, np.asarray(points[start:start + chunk_size],
+                                                dtype=np.float64).T)
+        top = heights.argmax(axis=1)
+        value = heights[np.arange(len(directions)), top]
+        better = value > best
+        best[better] = value[better]
+        index[better] = top[better] + start
+    return np.unique(index)
+
+
+def merge_coplanar(points, hull, angle=MERGE_ANGLE):
+    '''Returning the faces of the convex hull as list of facet index arrays.
+    Starting from the largest facet, a face takes the adjacent facets,
+    whose normal differs less than angle in degrees from the normal of its
+    first facet, so curved parts of the hull are not merged into one.'''
+    pts = np.asarray(points, dtype=np.float64)
+    tri = pts[hull]
+    a = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    area = np.linalg.norm(a, axis=1)
+    normals = a / np.maximum(area, 1e-300)[:, None]
+    edges = dict()
+    for f, (i, j, k) in enumerate(hull.tolist()):
+        for edge in ((i, j), (j, k), (k, i)):
+            edges[edge] = f
+    limit = math.cos(angle * math.pi / 180)
+    face = np.full(len(hull), -1)
+    groups = list()
+    for seed in np.argsort(-area, kind="mergesort"):
+        if face[seed] >= 0:
+            continue
+        face[seed] = len(groups)
+        group = [seed]
+        stack = [seed]
+        while stack:
+            i, j, k = hull[stack.pop()].tolist()
+            for edge in ((j, i), (k, j), (i, k)):
+                g = edges.get(edge)
+                if g is not None and face[g] < 0 and np.dot(normals[g], normals[seed]) >= limit:
+                    face[g] = len(groups)
+                    group.append(g)
+                    stack.append(g)
+        groups.append(np.array(group))
+    return groups
+
+
+def centre_of_mass(triangles):
+    '''Returning the centre of mass of a closed mesh of (N,3,3) triangles
+    or an IndexedMesh, or the centre of its area, if it has no volume'''
+    volume = 0.0
+    moment = np.zeros(3)
+    area = 0.0
+    centre = np.zeros(3)
+    for start in range(0, len(triangles), 1 << 16):
+        tri = np.asarray(triangles[start:start + (1 << 16)], dtype=np.float64)
+        cross = np.cross(tri[:, 1], tri[:, 2])
+        v = (tri[:, 0] * cross).sum(axis=1) / 6
+        volume += v.sum()
+        moment += np.dot(v, tri.sum(axis=1)) / 4
+        a = np.linalg.norm(np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0]), axis=1)
+        area += a.sum()
+        centre += np.dot(a, tri.sum(axis=1)) / 3
+    if abs(volume) > 1e-12:
+        return moment / volume
+    return centre / max(area, 1e-300)
+
+
+def stable_poses(mesh, best_n, angle=MERGE_ANGLE, directions=HULL_DIRECTIONS):
+    '''Returning the best_n faces of the convex hull, the mesh can rest on,
+    as [[normal, weight], ...]. The normal points outwards, like the area
+    vectors of the facets. A face is stable, if the centre of mass lies
+    above it, its weight is its area times the tipping angle, that is the
+    angle the mesh has to be tilted around the nearest edge of the face,
+    until the centre of mass passes that edge.
+    The hull is spanned by the vertices extreme along the given number of
+    directions, see extreme_points(). It is exact for meshs with fewer hull
+    vertices, which covers flat faces, and keeps curved meshs cheap.'''
+    # Each vertex is projected once, not once per facet it belongs to
+    if not isinstance(mesh, IndexedMesh):
+        mesh = IndexedMesh.from_triangles(mesh)
+    points = mesh.vertices
+    pts = np.asarray(points[extreme_points(points, sphere_directions(directions))],
+                     dtype=np.float64)
+    hull = convex_hull(pts)
+    com = centre_of_mass(mesh)
+    poses = list()
+    for group in merge_coplanar(pts, hull, angle):
+        tri = pts[hull[group]]
+        a = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+        area = np.linalg.norm(a, axis=1).sum() / 2
+        n = a.sum(axis=0)
+        n /= np.linalg.norm(n)
+        # The boundary of the face are the edges of one of its facets only
+        directed = set()
+        for i, j, k in hull[group].tolist():
+            directed.update(((i, j), (j, k), (k, i)))
+        boundary = np.array([edge for edge in directed if (edge[1], edge[0]) not in directed])
+        p, q = pts[boundary[:, 0]], pts[boundary[:, 1]]
+        inward = np.cross(n, q - p)
+        inward /= np.maximum(np.linalg.norm(inward, axis=1), 1e-300)[:, None]
+        margin = ((com - p) * inward).sum(axis=1).min()
+        height = float(np.dot(n, tri[0, 0] - com))
+        if margin > 0 and height > 0:
+            poses.append((area * math.atan2(margin, height), n))
+    poses.sort(key=lambda pose: -pose[0])
+    return [[(np.round(n, 6) + 0.0).tolist(), float("{:2f}".format(weight))]
+            for weight, n in poses[:best_n]]
@@ -0,0 +1,127 @@
+# Python 2.7 and 3.5
+# Bounding volume hierarchy over the facets of a mesh.
+
+import numpy as np
+from IndexedMesh import IndexedMesh
+
+# Facets per leaf of a FacetTree
+LEAF_SIZE = 64
+# Bits per axis of the Morton codes, that order the facets
+MORTON_BITS = 10
+MORTON_MASKS = ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF),
+                (8, 0x100F00F00F00F00F), (4, 0x10C30C30C30C30C3),
+                (2, 0x1249249249249249))
+
+
+class FacetTree(object):
+    """ Bounding volume hierarchy of axis aligned boxes over the facets of a
+    (N,3,3) triangle array or an IndexedMesh, built once per mesh. The
+    facets are ordered along a Morton curve of their centres and split
+    into leaves of LEAF_SIZE neighbouring facets. Each level of the
+    complete binary tree above them is stored as arrays of the box
+    corners, so a query descends one level per numpy operation and drops
+    all subtrees, whose box can not hold an answer:
+
+    min_heights(vectors) returns the lowest vertex height regarding each
+    vector, as approach_batch() does, and below(n, height) the facets with
+    a vertex not above height regarding n. Only the leaves near the support
+    plane are examined, which are few for tall and detailed meshs.
+    """
+    def __init__(self, triangles, leaf_size=LEAF_SIZE, chunk_size=1 << 16):
+        self.triangles = triangles
+        N = len(triangles)
+        lo = np.empty((N, 3))
+        hi = np.empty((N, 3))
+        for start in range(0, N, chunk_size):
+            tri = self.facets(np.arange(start, min(start + chunk_size, N)))
+            lo[start:start + chunk_size] = np.minimum(np.minimum(tri[:, 0], tri[:, 1]), tri[:, 2])
+            hi[start:start + chunk_size] = np.maximum(np.maximum(tri[:, 0], tri[:, 1]), tri[:, 2])
+        self.order = np.argsort(morton_codes(lo + hi), kind="mergesort").astype(np.int32)
+        self.leaf_size = leaf_size
+
+        # Leaves are padded to a power of two with leaves of no facets, whose
+        # box is a point of the mesh. Any vertex bounds the lowest height
+        # from above, the witness of a box is the first one in it.
+        leaves = max(-(-N // leaf_size), 1)
+        depth = int(np.ceil(np.log2(leaves)))
+        starts = np.arange(0, N, leaf_size)
+        witness = np.zeros((1 << depth, 3))
+        if N:
+            witness[:] = self.facets(self.order[-1:])[0, 0]
+            witness[:len(starts)] = self.facets(self.order[starts])[:, 0]
+        box_lo = witness.copy()
+        box_hi = witness.copy()
+        if N:
+            box_lo[:len(starts)] = np.minimum.reduceat(lo[self.order], starts)
+            box_hi[:len(starts)] = np.maximum.reduceat(hi[self.order], starts)
+        self.levels = [(box_lo, box_hi, witness)]
+        for _ in range(depth):
+            box_lo = np.minimum(box_lo[0::2], box_lo[1::2])
+            box_hi = np.maximum(box_hi[0::2], box_hi[1::2])
+            witness = witness[0::2]
+            self.levels.insert(0, (box_lo, box_hi, witness))
+
+
+    def facets(self, index):
+        '''Returning the float64 (len(index),3,3) triangles of the facets'''
+        if isinstance(self.triangles, IndexedMesh):
+            return self.triangles.vertices.take(self.triangles.faces.take(index, axis=0),
+                                                axis=0).astype(np.float64)
+        return np.asarray(self.triangles[index], dtype=np.float64)
+
+
+    def _leaf_facets(self, leaves):
+        '''Returning the facet indices of the leaves in ascending order'''
+        index = (leaves[:, None] * self.leaf_size + np.arange(self.leaf_size)).ravel()
+        return np.sort(self.order[index[index < len(self.order)]])
+
+
+    def min_heights(self, vectors):
+        '''Returning the lowest vertex height regarding each of the K vectors'''
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+        amin = np.full(len(vectors), np.inf)
+        for k, n in enumerate(vectors):
+            upper = np.inf
+            nodes = np.zeros(1, dtype=np.int64)
+            for level, (lo, hi, witness) in enumerate(self.levels):
+                lower = np.minimum(lo[nodes] * n, hi[nodes] * n).sum(axis=1)
+                upper = min(upper, float(np.dot(witness[nodes], n).min()))
+                nodes = nodes[lower <= upper]
+                if level < len(self.levels) - 1:
+                    nodes = (2 * nodes[:, None] + np.arange(2)).ravel()
+            index = self._leaf_facets(nodes)
+            if len(index):
+                amin[k] = np.dot(self.facets(index).reshape(-1, 3), n).min()
+        return amin
+
+
+    def below(self, n, height):
+        '''Returning the ascending indices of the facets with a vertex not
+        above height regarding the vector n, and their (M,3) vertex heights'''
+        n = np.asarray(n, dtype=np.float64)
+        nodes = np.zeros(1, dtype=np.int64)
+        for level, (lo, hi, witness) in enumerate(self.levels):
+            lower = np.minimum(lo[nodes] * n, hi[nodes] * n).sum(axis=1)
+            nodes = nodes[lower <= height]
+            if level < len(self.levels) - 1:
+                nodes = (2 * nodes[:, None] + np.arange(2)).ravel()
+        index = self._leaf_facets(nodes)
+        heights = np.dot(self.facets(index), n)
+        hit = heights.min(axis=1) <= height
+        return index[hit], heights[hit]
+
+
+def morton_codes(points, bits=MORTON_BITS):
+    '''Returning the Morton codes of (N,3) points, which interleave the bits
+    of their coordinates quantized in the bounding box'''
+    lower = points.min(axis=0) if len(points) else np.zeros(3)
+    extent = np.maximum(points.max(axis=0) - lower, 1e-12) if len(points) else np.ones(3)
+    q = ((points - lower) / extent * ((1 << bits) - 1)).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for axis in range(3):
+        # Spreading the bits of x to every third bit
+        x = q[:, axis]
+        for shift, mask in MORTON_MASKS:
+            x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+        codes |= x << np.uint64(axis)
+    return codes
@@ -3,32 +3,66 @@
 
 import sys, os
 import struct, time
+import re
+import io
+import numpy as np
 import ThreeMF
+from ArrayTweaker import as_triangles
+from IndexedMesh import IndexedMesh
+
+# Record layout of binary STL facets: normal, three vertices, attribute
+STL_DTYPE = np.dtype([("normal", "<f4", (3,)), ("v0", "<f4", (3,)),
+                      ("v1", "<f4", (3,)), ("v2", "<f4", (3,)),
+                      ("attr", "<u2")])
+
+# Vertex coordinates of ascii STL lines, parsed block by block
+VERTEX_LINE = re.compile(br"vertex([^\n]*)")
+ASCII_BLOCK_SIZE = 1 << 24
+
+# Facets per chunk, when writing STL files
+WRITE_CHUNK_SIZE = 16384
+ASCII_FACET = """\nfacet normal %f %f %f
+    outer loop
+        vertex %f %f %f
+        vertex %f %f %f
+        vertex %f %f %f
+    endloop
+endfacet"""
 
 
 class FileHandler():
     def __init__(self):
         return None
         
-    def loadMesh(self, inputfile):
-        '''load meshs and object attributes from file'''
+    def loadMesh(self, inputfile, arrays=False, progress=None):
+        '''load meshs and object attributes from file. With arrays, meshs
+        are returned as IndexedMesh, the vertices of STL files are welded.
+        progress is passed on to streamAsciiSTL.'''
         ## loading mesh format
         
         filetype = os.path.splitext(inputfile)[1].lower()
         if filetype == ".stl":
-            f=open(inputfile,"rb")
-            if "solid" in str(f.read(5).lower()):
-                f=open(inputfile,"r")
-                objs = [{"Mesh": self.loadAsciiSTL(f)}]
-                if len(objs[0]["Mesh"]) < 3:
-                     f.seek(5, os.SEEK_SET)
-                     objs = [{"Mesh": self.loadBinarySTL(f)}]
-            else:
-                objs = [{"Mesh": self.loadBinarySTL(f)}]
+            with open(inputfile, "rb") as f:
+                mesh = None
+                if "solid" in str(f.read(5).lower()):
+                    f.seek(0)
+                    mesh = self.streamAsciiSTL(f, progress)
+                    if len(mesh) == 0:  # Binary STL with a "solid" header
+                        mesh = None
+                    elif not arrays:
+                        mesh = mesh.reshape(-1, 3).tolist()
+                if mesh is None and arrays:
+                    mesh = self.mapBinarySTL(inputfile)
+                elif mesh is None:
+                    f.seek(5, os.SEEK_SET)
+                    mesh = self.loadBinarySTL(f)
+            if arrays:
+                mesh = IndexedMesh.from_triangles(as_triangles(mesh))
+            objs = [{"Mesh": mesh}]
                 
         elif filetype == ".3mf":
             
-            objs = ThreeMF.Read3mf(inputfile)
+            objs = ThreeMF.Read3mf(inputfile, arrays)
         else:
             print("File type is not supported.")
             sys.exit()
@@ -37,13 +71,54 @@ class FileHandler():
 
 
     def loadAsciiSTL(self, f):
-        '''Reading mesh data from ascii STL'''
-        mesh=list()
-        for line in f:
-            if "vertex" in line:
-                data=line.split()[1:]
-                mesh.append([float(data[0]), float(data[1]), float(data[2])])
-        return mesh
+        '''Reading mesh data from ascii STL, opened in binary mode'''
+        return self.streamAsciiSTL(f).reshape(-1, 3).tolist()
+
+    def streamAsciiSTL(self, f, progress=None, block_size=ASCII_BLOCK_SIZE):
+        '''Reading the vertices of an ascii STL, opened in binary mode, block
+        by block into a float64 array of the shape (N,3,3). Only one block and
+        the growing result are held in memory. progress is called with the
+        bytes read so far and the total size after each block.'''
+        start = f.tell()
+        f.seek(0, os.SEEK_END)
+        total = f.tell() - start
+        f.seek(start, os.SEEK_SET)
+
+        # An ascii facet takes about 250 bytes, so this is rarely exceeded
+        capacity = max(total // 80, 3)
+        mesh = np.empty((capacity, 3))
+        count = done = 0
+        tail = b""
+        while True:
+            block = f.read(block_size)
+            done += len(block)
+            if block:
+                data = tail + block
+                cut = data.rfind(b"\n") + 1
+                data, tail = data[:cut], data[cut:]
+            else:
+                data, tail = tail, b""
+            lines = VERTEX_LINE.findall(data)
+            if lines:
+                values = np.fromstring(b" ".join(lines), sep=" ")
+                if len(values) != 3 * len(lines):
+                    raise ValueError("Malformed vertex line in ascii STL")
+                if count + len(lines) > capacity:
+                    capacity = max(capacity * 3 // 2, count + len(lines))
+                    grown = np.empty((capacity, 3))
+                    grown[:count] = mesh[:count]
+                    mesh = grown
+                mesh[count:count + len(lines)] = values.reshape(-1, 3)
+                count += len(lines)
+            if progress is not None:
+                progress(done, total)
+            if not block:
+                break
+
+        if count % 3 != 0:
+            raise ValueError("Ascii STL has %d vertices, which is no multiple of 3" % count)
+        mesh.resize((count, 3), refcheck=False)
+        return mesh.reshape(-1, 3, 3)
 
     def loadBinarySTL(self, f):
         '''Reading mesh data from binary STL'''
@@ -59,85 +134,104 @@ class FileHandler():
         return mesh
 
 
+    def mapBinarySTL(self, inputfile):
+        '''Memory-mapping a binary STL. The facets are returned as read-only
+        record array of STL_DTYPE, no facet is copied or unpacked.'''
+        size = os.path.getsize(inputfile)
+        with open(inputfile, "rb") as f:
+            header = f.read(84)
+        faceCount = self.checkBinarySTL(header, size, inputfile)
+        if faceCount == 0:
+            return np.zeros(0, dtype=STL_DTYPE)
+        return np.memmap(inputfile, dtype=STL_DTYPE, mode="r", offset=84,
+                         shape=(faceCount,))
+
+    def readSTLBytes(self, data, name="STL data"):
+        '''Reading an ascii or binary STL from a bytes object into an
+        IndexedMesh'''
+        if data[:5].lower() == b"solid":
+            mesh = self.streamAsciiSTL(io.BytesIO(data))
+            if len(mesh) > 0:
+                return IndexedMesh.from_triangles(mesh)
+        faceCount = self.checkBinarySTL(data[:84], len(data), name)
+        records = np.frombuffer(data, dtype=STL_DTYPE, count=faceCount, offset=84)
+        return IndexedMesh.from_triangles(as_triangles(records))
+
+    def checkBinarySTL(self, header, size, name):
+        '''Returning the facet count of the binary STL header, after checking
+        it against the size of the file'''
+        if len(header) < 84:
+            raise ValueError("%s is too short for a binary STL" % name)
+        faceCount = struct.unpack('<I', header[80:84])[0]
+        if size != 84 + faceCount * STL_DTYPE.itemsize:
+            raise ValueError("%s announces %d facets, but has %d bytes instead of %d"
+                             % (name, faceCount, size, 84 + faceCount * STL_DTYPE.itemsize))
+        return faceCount
+
+
     def rotate3MF(self, *arg):
         ThreeMF.rotate3MF(*arg)
         
                   
     def rotateSTL(self, R, content, filename):
-        '''Rotate the object and save as ascii STL.'''
-        face=[]
-        mesh=[]
-        i=0
-
-        rotated_content=list(map(self.rotate_vert, content, [R]*len(content)))
-        
-        for li in rotated_content:      
-            face.append(li)
-            i+=1
-            if i%3==0:
-                mesh.append([face[0],face[1],face[2]])
-                face=[]
-
-        mesh = map(self.calc_nomal, mesh)
-
-        tweaked = list("solid %s" % filename)
-        tweaked += list(map(self.write_facett, mesh))
-        tweaked.append("\nendsolid %s\n" % filename)
-        tweaked = "".join(tweaked)
-        
-        return tweaked
-
-    def rotate_vert(self, a, R):
-        return [a[0]*R[0][0]+a[1]*R[1][0]+a[2]*R[2][0],
-                              a[0]*R[0][1]+a[1]*R[1][1]+a[2]*R[2][1],
-                              a[0]*R[0][2]+a[1]*R[1][2]+a[2]*R[2][2]]
-    def calc_nomal(self, face):
-        v=[face[1][0]-face[0][0],face[1][1]-face[0][1],face[1][2]-face[0][2]]
-        w=[face[2][0]-face[0][0],face[2][1]-face[0][1],face[2][2]-face[0][2]]
-        a=[v[1]*w[2]-v[2]*w[1],v[2]*w[0]-v[0]*w[2],v[0]*w[1]-v[1]*w[0]]        
-        return [[a[0],a[1],a[2]],face[0],face[1],face[2]]
-    
-    def write_facett(self, facett):
-        return"""\nfacet normal %f %f %f
-    outer loop
-        vertex %f %f %f
-        vertex %f %f %f
-        vertex %f %f %f
-    endloop
-endfacet""" % (facett[0][0], facett[0][1], facett[0][2], facett[1][0], 
-               facett[1][1], facett[1][2], facett[2][0], facett[2][1], 
-                facett[2][2], facett[3][0], facett[3][1], facett[3][2])
+        '''Rotate the object and return it as ascii STL string.'''
+        buf = io.BytesIO()
+        self.streamSTL(R, content, buf, filename)
+        return buf.getvalue().decode()
 
     def rotatebinSTL(self, R, content, filename):
-        '''Rotate the object and save as binary STL. This module is currently replaced
-        by the ascii version. If you want to use binary STL, please do the
-        following changes in Tweaker.py: Replace "rotatebinSTL" by "rotateSTL"
-        and set in the write sequence the open outfile option from "w" to "wb".
-        However, the ascii version is much faster in Python 3.'''
-        face=[]
-        mesh=[]
-        i=0
-
-        rotated_content=list(map(self.rotate_vert, content, [R]*len(content)))
-        
-        for li in rotated_content:      
-            face.append(li)
-            i+=1
-            if i%3==0:
-                mesh.append([face[0],face[1],face[2]])
-                face=[]
-
-        mesh = map(self.calc_nomal, mesh)
-
-        tweaked = "Tweaked on {}".format(time.strftime("%a %d %b %Y %H:%M:%S")
-                                ).encode().ljust(79, b" ") + b"\n"
-        tweaked += struct.pack("<I", int(len(content)/3)) #list("solid %s" % filename)
-        #tweaked += list(map(self.write_bin_facett, mesh))
-        for facett in mesh:
-            tweaked += struct.pack("<fff", facett[0][0], facett[0][1], facett[0][2])
-            tweaked += struct.pack("<fff", facett[1][0], facett[1][1], facett[1][2])
-            tweaked += struct.pack("<fff", facett[2][0], facett[2][1], facett[2][2])
-            tweaked += struct.pack("<fff", facett[3][0], facett[3][1], facett[3][2])
-            tweaked += struct.pack("<H", 0)
-            
-        return tweaked
+        '''Rotate the object and return it as binary STL bytes.'''
+        buf = io.BytesIO()
+        self.streamSTL(R, content, buf, filename, binary=True)
+        return buf.getvalue()
+
+    def writeSTL(self, R, mesh, outfile, name="", binary=False,
+                 chunk_size=WRITE_CHUNK_SIZE):
+        '''Rotate the object and save it as ascii or binary STL file.'''
+        with open(outfile, "wb") as f:
+            self.streamSTL(R, mesh, f, name, binary, chunk_size)
+
+    def streamSTL(self, R, mesh, f, name="", binary=False,
+                  chunk_size=WRITE_CHUNK_SIZE):
+        '''Rotate the object and write it as STL into the binary stream f.
+        The facets are rotated and written chunk by chunk, so the memory use
+        does not depend on the size of the mesh.'''
+        tri = as_triangles(mesh)
+        R = np.asarray(R, dtype=np.float64)
+        if binary:
+            f.write("Tweaked on {}".format(time.strftime("%a %d %b %Y %H:%M:%S")
+                                ).encode().ljust(79, b" ") + b"\n")
+            f.write(struct.pack("<I", len(tri)))
+        else:
+            f.write(("solid %s" % name).encode())
+
+        for start in range(0, len(tri), chunk_size):
+            facets = self.rotate_facets(R, tri[start:start + chunk_size])
+            if binary:
+                records = np.zeros(len(facets), dtype=STL_DTYPE)
+                records["normal"] = facets[:, 0]
+                records["v0"] = facets[:, 1]
+                records["v1"] = facets[:, 2]
+                records["v2"] = facets[:, 3]
+                f.write(records.tobytes())
+            else:
+                text = ASCII_FACET * len(facets) % tuple(facets.ravel().tolist())
+                f.write(text.encode())
+
+        if not binary:
+            f.write(("\nendsolid %s\n" % name).encode())
+
+    def rotate_facets(self, R, triangles):
+        '''Returning the rotated facets as (N,4,3) array of the normal, which
+        is not normalized, and the three vertices.'''
+        tri = np.asarray(triangles, dtype=np.float64)
+        facets = np.empty((len(tri), 4, 3))
+        for j in range(3):
+            facets[:, 1:, j] = (tri[..., 0]*R[0][j] + tri[..., 1]*R[1][j]
+                                + tri[..., 2]*R[2][j])
+        v = facets[:, 2] - facets[:, 1]
+        w = facets[:, 3] - facets[:, 1]
+        facets[:, 0, 0] = v[:, 1]*w[:, 2] - v[:, 2]*w[:, 1]
+        facets[:, 0, 1] = v[:, 2]*w[:, 0] - v[:, 0]*w[:, 2]
+        facets[:, 0, 2] = v[:, 0]*w[:, 1] - v[:, 1]*w[:, 0]
+        return facets
@@ -7,6 +7,160 @@ import random
 import time
 import itertools
 from collections import Counter
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Increase this number with every change, that alters the results of Tweak.
+# It is part of the keys of the ResultCache.
+ALGORITHM_VERSION = 3
+
+# Orientations closer than this are duplicates, see Tweak.remove_duplicates
+DUPLICATE_TOLERANCE = 0.001
+NEIGHBOUR_CELLS = list(itertools.product((-1, 0, 1), repeat=3))
+
+# Number of facets between two checks of the cancel token and progress calls
+CHECK_INTERVAL = 4096
+
+
+class TweakCancelled(Exception):
+    """ Raised by Tweak, as soon as its cancel token is set. """
+
+
+class CancelToken:
+    """ Token to stop a running Tweak from another thread by cancel().
+    A threading.Event can be used as well. """
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_set(self):
+        return self.cancelled
+
+
+class TweakMetrics:
+    """ The TweakMetrics collect timings and counts of a run of Tweak, pass
+    an instance as metrics argument. Per phase, the seconds and the memory
+    high-water mark are recorded, per examined orientation the results and,
+    unless all orientations are examined at once, the time spent in
+    approachvertex, lithograph and get_touching_line. Counts are the number
+    of facets, of candidates before and after remove_duplicates and of the
+    facets processed over all candidates.
+
+    on_phase(name, seconds) and on_candidate(record) are called as soon as a
+    phase or an orientation is done. as_dict() and to_json() return all
+    metrics for monitoring.
+    """
+    enabled = True
+
+    def __init__(self, on_phase=None, on_candidate=None):
+        self.on_phase = on_phase
+        self.on_candidate = on_candidate
+        self.phases = dict()
+        self.order = list()
+        self.counts = dict()
+        self.candidates = list()
+        self.results = dict()
+
+    def phase(self, name):
+        '''Returning a context, whose duration is added to phase name'''
+        return _Phase(self, name)
+
+    def add_time(self, name, seconds):
+        if name not in self.phases:
+            self.phases[name] = dict(seconds=0.0, calls=0, peak_rss_mb=None)
+            self.order.append(name)
+        self.phases[name]["seconds"] += seconds
+        self.phases[name]["calls"] += 1
+
+    def seconds(self, name):
+        return self.phases[name]["seconds"] if name in self.phases else 0.0
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def candidate(self, orientation, bottomA, overhang, line, **seconds):
+        record = dict(orientation=list(orientation), bottomA=bottomA,
+                      overhang=overhang, line=line, seconds=seconds)
+        self.candidates.append(record)
+        if self.on_candidate is not None:
+            self.on_candidate(record)
+
+    def result(self, tweak):
+        self.results = dict(Zn=tweak.Zn, Unprintability=tweak.Unprintability,
+                            bottomArea=tweak.bottomArea,
+                            overhang=tweak.overhang, line=tweak.line)
+        self.results["peak_rss_mb"] = peak_rss_mb()
+
+    def as_dict(self):
+        return dict(phases=[dict(name=name, **self.phases[name]) for name in self.order],
+                    counts=dict(self.counts), candidates=list(self.candidates),
+                    result=dict(self.results))
+
+    def to_json(self, **kwargs):
+        import json
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+class _NoMetrics:
+    """ Stand-in for TweakMetrics, that records nothing. """
+    enabled = False
+
+    def phase(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_time(self, name, seconds):
+        pass
+
+    def seconds(self, name):
+        return 0.0
+
+    def count(self, name, value):
+        pass
+
+    def candidate(self, orientation, bottomA, overhang, line, **seconds):
+        pass
+
+    def result(self, tweak):
+        pass
+
+NO_METRICS = _NoMetrics()
+
+
+class _Phase:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.stime = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.time() - self.stime
+        self.metrics.add_time(self.name, seconds)
+        self.metrics.phases[self.name]["peak_rss_mb"] = peak_rss_mb()
+        if self.metrics.on_phase is not None:
+            self.metrics.on_phase(self.name, seconds)
+        return False
+
+
+def peak_rss_mb():
+    '''Returning the memory high-water mark of the process in MB or None'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / 1024.0 ** (2 if sys.platform == "darwin" else 1), 1)
+
 
 class Tweak:
     """ The Tweaker is an auto rotate class for 3D objects.
@@ -22,6 +176,13 @@ class Tweak:
     it may depend on multiple factors such as material used, printing
      temperature, printing speed, etc.
 
+    Hosts, that run the Tweak in a thread, may pass progress, a function
+     called as progress(phase, done, total) every CHECK_INTERVAL facets,
+     and cancel, a CancelToken or threading.Event. Once it is set, the
+     Tweak stops with TweakCancelled.
+    With a seed, the random sampling of the bi-algorithmic mode and so the
+     result is reproducible.
+
     Following attributes of the class are supported:
     The tweaked z-axis' vector .z.
     Euler coords .v and .phi, where v is orthogonal to both z and z' and phi
@@ -32,32 +193,54 @@ class Tweak:
     And the relative unprintability of the tweaked object. If this value is
      greater than 15, a support structure is suggested.
         """
-    def __init__(self, mesh, bi_algorithmic, verbose, CA=45, n=[0,0,-1]):
+    # Some values for scaling the printability, see target_function()
+    ABSLIMIT = 100
+    RELLIMIT = 1
+    LINE_FAKTOR = 0.5
+
+    def __init__(self, mesh, bi_algorithmic, verbose, CA=45, n=[0,0,-1],
+                 metrics=None, progress=None, cancel=None, seed=None):
         
         self.bi_algorithmic = bi_algorithmic
+        self.seed = seed
+        self.metrics = metrics or NO_METRICS
+        self.progress = progress
+        self.cancel = cancel
         
-        content = self.arrange_mesh(mesh)
+        with self.metrics.phase("arrange_mesh"):
+            content = self.arrange_mesh(mesh)
+        self.metrics.count("facets", self.count_facets(content))
         #print("Object has {} facets".format(len(content)))
         arcum_time = dialg_time = lit_time=0
                 
         ## Calculating initial printability
-        amin = self.approachfirstvertex(content)
-        bottomA, overhangA, lineL = self.lithograph(content,[0.0,0.0,1.0],amin,CA)
+        with self.metrics.phase("initial_lithograph"):
+            amin = self.approachfirstvertex(content)
+            bottomA, overhangA, lineL = self.lithograph(content,[0.0,0.0,1.0],amin,CA)
         liste = [[[0.0,0.0,1.0], bottomA, overhangA, lineL]]
 
 
         ## Searching promising orientations: 
         ## Format: [[vector1, gesamtA1],...[vector5, gesamtA5]]: %s", o)
         arcum_time = time.time()
-        orientations = self.area_cumulation(content, n)
+        with self.metrics.phase("area_cumulation"):
+            orientations = self.area_cumulation(content, n)
 
         arcum_time = time.time() - arcum_time
         if bi_algorithmic:
             dialg_time = time.time()
-            orientations += self.egde_plus_vertex(mesh, 12)
+            with self.metrics.phase("egde_plus_vertex"):
+                # Areas and sample counts are compared by their shares
+                orientations = (self.value_shares(orientations)
+                                + self.value_shares(self.egde_plus_vertex(mesh, 12)))
             dialg_time = time.time() - dialg_time
             
-            orientations = self.remove_duplicates(orientations)
+            self.metrics.count("candidates", len(orientations))
+            with self.metrics.phase("remove_duplicates"):
+                orientations = self.remove_duplicates(orientations)
+        else:
+            self.metrics.count("candidates", len(orientations))
+        self.metrics.count("unique_candidates", len(orientations))
             
         if verbose:
             print("Examine {} orientations:".format(len(orientations)))
@@ -67,27 +250,14 @@ class Tweak:
         
         # Calculate the printability of each orientation
         lit_time = time.time()
-        for side in orientations:
-            orientation = [float("{:6f}".format(-i)) for i in side[0]]
-            ## vector: sn, cum_A: side[1]
-            amin=self.approachvertex(content, orientation)
-            bottomA, overhangA, lineL = self.lithograph(content, orientation, amin, CA)
-            liste.append([orientation, bottomA, overhangA, lineL])   #[Vector, touching area, Overhang, Touching_Line]
+        with self.metrics.phase("evaluate_orientations"):
+            liste += self.evaluate_orientations(content, orientations, CA)
+        with self.metrics.phase("refine_orientations"):
+            liste += self.refine_orientations(content, liste, CA)
         
         
         # target function
-        Unprintability = sys.maxsize
-        for orientation, bottomA, overhangA, lineL in liste:
-            F = self.target_function(bottomA, overhangA, lineL) # touching area: i[1], overhang: i[2], touching line i[3]
-            if F<Unprintability - 0.05:
-                Unprintability=F
-                bestside = [orientation, bottomA, overhangA, lineL]
-            if verbose:
-                print("  %-32s %-18s%-18s%-18s%-18s " %(str(orientation), round(bottomA,3), 
-                      round(overhangA,3),round(lineL,3), round(F,3)))
-            time.sleep(0)  # Yield, so other threads get a bit of breathing space.
-            
-           
+        Unprintability, bestside = self.best_orientation(liste, verbose)
            
         lit_time = time.time() - lit_time
         if verbose:
@@ -101,9 +271,71 @@ Time-stats of algorithm:
            tot=arcum_time + dialg_time + lit_time))  
            
            
-        if bestside:
-            [v,phi,R] = self.euler(bestside)
-            
+        self.set_result(Unprintability, bestside)
+        self.metrics.result(self)
+
+
+    def count_facets(self, content):
+        return len(content)
+
+
+    def checkpoint(self, phase, done, total):
+        '''Raising TweakCancelled if the cancel token is set, otherwise
+        reporting the progress of phase as progress(phase, done, total).
+        The facet loops call it every CHECK_INTERVAL facets.'''
+        if self.cancel is not None and self.cancel.is_set():
+            raise TweakCancelled("Tweak cancelled during %s" % phase)
+        if self.progress is not None:
+            self.progress(phase, done, total)
+
+
+    def evaluate_orientations(self, content, orientations, CA):
+        '''Calculating touching area, overhang and touching line of each orientation'''
+        liste = list()
+        for k, side in enumerate(orientations):
+            self.checkpoint("evaluate_orientations", k, len(orientations))
+            orientation = [float("{:6f}".format(-i)) for i in side[0]]
+            ## vector: sn, cum_A: side[1]
+            stime = time.time()
+            line_time = self.metrics.seconds("get_touching_line")
+            amin=self.approachvertex(content, orientation)
+            ltime = time.time()
+            bottomA, overhangA, lineL = self.lithograph(content, orientation, amin, CA)
+            liste.append([orientation, bottomA, overhangA, lineL])   #[Vector, touching area, Overhang, Touching_Line]
+            self.metrics.candidate(orientation, bottomA, overhangA, lineL,
+                approachvertex=ltime - stime, lithograph=time.time() - ltime,
+                get_touching_line=self.metrics.seconds("get_touching_line") - line_time)
+            self.metrics.count("facets_processed", 2 * len(content))
+        return liste
+
+
+    def refine_orientations(self, content, liste, CA):
+        '''Returning further evaluated orientations in the surroundings of
+        the best ones of liste. Tweak examines only the candidates, see
+        ArrayTweak for a local search.'''
+        return list()
+
+
+    def best_orientation(self, liste, verbose=False):
+        '''Returning the lowest unprintability of the evaluated orientations
+        in liste and the orientation. Later orientations have to be better
+        by 0.05 to replace an earlier one.'''
+        Unprintability = sys.maxsize
+        bestside = None
+        for orientation, bottomA, overhangA, lineL in liste:
+            F = self.target_function(bottomA, overhangA, lineL) # touching area: i[1], overhang: i[2], touching line i[3]
+            if F<Unprintability - 0.05:
+                Unprintability=F
+                bestside = [orientation, bottomA, overhangA, lineL]
+            if verbose:
+                print("  %-32s %-18s%-18s%-18s%-18s " %(str(orientation), round(bottomA,3), 
+                      round(overhangA,3),round(lineL,3), round(F,3)))
+        return Unprintability, bestside
+
+
+    def set_result(self, Unprintability, bestside):
+        '''Setting the result attributes to the orientation bestside'''
+        [v,phi,R] = self.euler(bestside)
         self.v=v
         self.phi=phi
         self.R=R
@@ -116,11 +348,8 @@ Time-stats of algorithm:
 
     def target_function(self, touching, overhang, line):
         '''This function returns the printability with the touching area and overhang given.'''
-        ABSLIMIT=100             # Some values for scaling the printability
-        RELLIMIT=1
-        LINE_FAKTOR = 0.5
-        touching_line = line * LINE_FAKTOR
-        F = (overhang/ABSLIMIT) + (overhang / (touching+touching_line) /RELLIMIT)
+        touching_line = line * self.LINE_FAKTOR
+        F = (overhang/self.ABSLIMIT) + (overhang / (touching+touching_line) /self.RELLIMIT)
         ret = float("{:f}".format(F))
         return ret
         
@@ -139,32 +368,35 @@ Time-stats of algorithm:
                 a=[round(v[1]*w[2]-v[2]*w[1],6), round(v[2]*w[0]-v[0]*w[2],6), round(v[0]*w[1]-v[1]*w[0],6)]
                 content.append([a,face[0],face[1],face[2]])
                 face=[]
-            time.sleep(0)  # Yield, so other threads get a bit of breathing space.
+                if len(content) % CHECK_INTERVAL == 0:
+                    self.checkpoint("arrange_mesh", len(content), len(mesh)//3)
         return content
 
     
     def approachfirstvertex(self,content):
         '''Returning the lowest z value'''
         amin=sys.maxsize
-        for li in content:
+        for i, li in enumerate(content):
             z=min([li[1][2],li[2][2],li[3][2]])
             if z<amin:
                 amin=z
-            time.sleep(0)  # Yield, so other threads get a bit of breathing space.
+            if i % CHECK_INTERVAL == 0:
+                self.checkpoint("approachfirstvertex", i, len(content))
         return amin
 
 
     def approachvertex(self, content, n):
         '''Returning the lowest value regarding vector n'''
         amin=sys.maxsize
-        for li in content:
+        for i, li in enumerate(content):
+            if i % CHECK_INTERVAL == 0:
+                self.checkpoint("approachvertex", i, len(content))
             a1 = li[1][0]*n[0] +li[1][1]*n[1] +li[1][2]*n[2]
             a2 = li[2][0]*n[0] +li[2][1]*n[1] +li[2][2]*n[2]
             a3 = li[3][0]*n[0] +li[3][1]*n[1] +li[3][2]*n[2]          
             an=min([a1,a2,a3])
             if an<amin:
                 amin=an
-            time.sleep(0)  # Yield, so other threads get a bit of breathing space.
         return amin
 
         
@@ -178,8 +410,9 @@ Time-stats of algorithm:
         
         anti_n = [float(-i) for i in n]
 
-        for li in content:
-            time.sleep(0)  # Yield, so other threads get a bit of breathing space.
+        for i, li in enumerate(content):
+            if i % CHECK_INTERVAL == 0:
+                self.checkpoint("lithograph", i, len(content))
             a=li[0]
             norma=math.sqrt(a[0]*a[0] + a[1]*a[1] + a[2]*a[2])
             if norma < 2:
@@ -195,23 +428,24 @@ Time-stats of algorithm:
                     if 0.00001 < math.fabs(a[0]-anti_n[0]) + math.fabs(a[1]-anti_n[1]) + math.fabs(a[2]-anti_n[2]):
                         ali = 0.8 * ali
                     Overhang += ali
+                elif self.metrics.enabled:
+                    bottomA += ali
+                    stime = time.time()
+                    LineL += self.get_touching_line([a1,a2,a3], li, touching_height)
+                    self.metrics.add_time("get_touching_line", time.time() - stime)
                 else:
                     bottomA += ali
                     LineL += self.get_touching_line([a1,a2,a3], li, touching_height)
-                time.sleep(0)  # Yield, so other threads get a bit of breathing space.
         return bottomA, Overhang, LineL
     
     def get_touching_line(self, a, li, touching_height):
-        touch_lst = list()
-        for i in range(3):
-            if a[i] < touching_height:
-                touch_lst.append(li[1+i])
-        combs = list(itertools.combinations(touch_lst, 2))
-        if len(combs) <= 1:
+        '''Returning the perimeter of a facet, whose three vertices touch.
+        With two touching vertices, the single edge does not count.'''
+        if not (a[0] < touching_height and a[1] < touching_height
+                and a[2] < touching_height):
             return 0
         length = 0
-        for p1, p2 in combs:
-            time.sleep(0)  # Yield, so other threads get a bit of breathing space.
+        for p1, p2 in ((li[1], li[2]), (li[1], li[3]), (li[2], li[3])):
             length += math.sqrt((p2[0]-p1[0])**2 + (p2[1]-p1[1])**2 
                                         + (p2[2]-p1[2])**2)
         return length
@@ -221,7 +455,9 @@ Time-stats of algorithm:
         if self.bi_algorithmic: best_n = 7
         else: best_n = 5
         orient = Counter()
-        for li in content:       # Cumulate areavectors
+        for i, li in enumerate(content):       # Cumulate areavectors
+            if i % CHECK_INTERVAL == 0:
+                self.checkpoint("area_cumulation", i, len(content))
             an = li[0]
             A = math.sqrt(an[0]*an[0] + an[1]*an[1] + an[2]*an[2])
             
@@ -229,7 +465,6 @@ Time-stats of algorithm:
                 an = [float("{:1.6f}".format(i/A, 6)) for i in an]
                 orient[tuple(an)] += A
 
-        time.sleep(0)  # Yield, so other threads get a bit of breathing space.
         top_n = orient.most_common(best_n)
         return [[[0.0,0.0,1.0], 0.0]] + [[list(el[0]), float("{:2f}".format(el[1]))] for el in top_n]
        
@@ -241,11 +476,11 @@ Time-stats of algorithm:
         if vcount < 10000: it = 5
         elif vcount < 25000: it = 2
         else: it = 1           
-        self.mesh = mesh
-        lst = map(self.calc_random_normal, list(range(vcount))*it)
+        rand = random.Random(self.seed)
+        lst = map(lambda i: self.calc_random_normal(mesh, i, rand),
+                  list(range(vcount))*it)
         lst = filter(lambda x: x is not None, lst)
         
-        time.sleep(0)  # Yield, so other threads get a bit of breathing space.
         orient = Counter(lst)
         
         top_n = orient.most_common(best_n)
@@ -253,17 +488,19 @@ Time-stats of algorithm:
 
         return [[list(el[0]), el[1]] for el in top_n]
 
-    def calc_random_normal(self, i):
+    def calc_random_normal(self, mesh, i, rand=random):
+        if i % CHECK_INTERVAL == 0:
+            self.checkpoint("egde_plus_vertex", i, len(mesh))
         if i%3 == 0:
-            v = self.mesh[i]
-            w = self.mesh[i+1]
+            v = mesh[i]
+            w = mesh[i+1]
         elif i%3 == 1:
-            v = self.mesh[i]
-            w = self.mesh[i+1]
+            v = mesh[i]
+            w = mesh[i+1]
         else:
-            v = self.mesh[i]
-            w = self.mesh[i-2]
-        r_v = random.choice(self.mesh)
+            v = mesh[i]
+            w = mesh[i-2]
+        r_v = rand.choice(mesh)
         v = [v[0]-r_v[0], v[1]-r_v[1], v[2]-r_v[2]]
         w = [w[0]-r_v[0], w[1]-r_v[1], w[2]-r_v[2]]
         a=[v[1]*w[2]-v[2]*w[1],v[2]*w[0]-v[0]*w[2],v[0]*w[1]-v[1]*w[0]]
@@ -272,20 +509,40 @@ Time-stats of algorithm:
             return tuple([round(d/n, 6) for d in a])
 
 
-    def remove_duplicates(self, o):
-        '''Removing duplicates in orientation'''
-        orientations = list()
-        for i in o:
-            duplicate = None
-            for j in orientations:
-                time.sleep(0)  # Yield, so other threads get a bit of breathing space.
-                dif = math.sqrt( (i[0][0]-j[0][0])**2 + (i[0][1]-j[0][1])**2 + (i[0][2]-j[0][2])**2 )
-                if dif < 0.001:
-                    duplicate = True
+    def value_shares(self, o):
+        '''Returning the orientations with their cumulated area or count
+        divided by the sum of all, so the values of both searches compare'''
+        total = sum(i[1] for i in o)
+        return [[i[0], i[1] / total if total > 0 else 0.0] for i in o]
+
+
+    def remove_duplicates(self, o, tolerance=DUPLICATE_TOLERANCE):
+        '''Removing duplicates in orientation. The orientations are taken by
+        descending value, one closer than tolerance to a kept one is dropped,
+        so the kept ones lie at least tolerance apart. They are returned in
+        their former order. The kept vectors are hashed into a grid of cells
+        of size tolerance, so each orientation is only compared with the
+        ones in the 27 neighbouring cells.'''
+        kept = list()
+        grid = dict()
+        # Equal values keep their order, the first one is kept
+        for k in sorted(range(len(o)), key=lambda k: -o[k][1]):
+            i = o[k]
+            cell = tuple(int(math.floor(x / tolerance)) for x in i[0])
+            duplicate = False
+            for offset in NEIGHBOUR_CELLS:
+                for j in grid.get((cell[0]+offset[0], cell[1]+offset[1],
+                                   cell[2]+offset[2]), ()):
+                    dif = math.sqrt( (i[0][0]-j[0])**2 + (i[0][1]-j[1])**2 + (i[0][2]-j[2])**2 )
+                    if dif < tolerance:
+                        duplicate = True
+                        break
+                if duplicate:
                     break
-            if duplicate is None:
-                orientations.append(i)
-        return orientations
+            if not duplicate:
+                grid.setdefault(cell, list()).append(i[0])
+                kept.append(k)
+        return [o[k] for k in sorted(kept)]
 
 
 
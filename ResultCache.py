@@ -0,0 +1,158 @@
+# Python 2.7 and 3.5
+# Persistent cache of orientation results, addressed by the mesh content.
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import numpy as np
+from MeshTweaker import Tweak, ALGORITHM_VERSION
+from ArrayTweaker import as_triangles, CHUNK_SIZE
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "tweaker",
+                            "results.sqlite")
+FIELDS = ("Zn", "v", "phi", "R", "Unprintability", "bottomArea", "overhang",
+          "line")
+# Arguments of the tweakers, that do not change the results
+RUNTIME_OPTIONS = ("normals", "chunk_size", "workers", "metrics", "progress",
+                   "cancel", "tree")
+
+
+class CachedResult:
+    """ Result of a cached tweak, with the same attributes as Tweak. """
+    def __init__(self, values):
+        for field in FIELDS:
+            setattr(self, field, values[field])
+
+
+class ResultCache:
+    """ The ResultCache stores the results of Tweak in a SQLite database.
+    Keys are hashes of the vertex buffer, the name of the tweaker class, the
+    critical angle CA, the bi_algorithmic flag, further options of the
+    tweaker, like the candidates of ArrayTweak, and
+    MeshTweaker.ALGORITHM_VERSION, so results of an older algorithm or of
+    another tweaker are never returned.
+
+    The database holds at most max_entries results, the least recently used
+    ones are evicted. Every write is a transaction of its own and concurrent
+    processes wait for each other, so a cache can be shared by the workers
+    of a batch. Each process has to open its own ResultCache though.
+    .hits and .misses count the lookups of this instance, stats() returns
+    the counters of all processes, that used the database.
+    """
+    def __init__(self, path=DEFAULT_PATH, max_entries=100000, timeout=30):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # Created by a concurrent process
+                pass
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.transaction():
+            self.db.execute("""CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, atime REAL NOT NULL)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_atime ON results (atime)")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY, value INTEGER NOT NULL)""")
+            self.db.execute("""INSERT OR IGNORE INTO counters VALUES
+                ('hits', 0), ('misses', 0), ('evictions', 0)""")
+
+
+    def transaction(self):
+        '''Returning a context, that runs its statements as one immediate
+        transaction, which other processes can not interleave.'''
+        return _Transaction(self.db)
+
+
+    def key(self, mesh, CA, bi_algorithmic, options=None, tweaker=Tweak):
+        '''Returning the key of a mesh and the tweak parameters. options are
+        the further keyword arguments of the tweaker class, whose results
+        are kept apart from those of other tweakers.'''
+        tri = as_triangles(mesh)
+        h = hashlib.sha256()
+        h.update(("%s|%s|%r|%r|%d|" % (ALGORITHM_VERSION, tweaker.__name__, float(CA),
+                                       bool(bi_algorithmic), len(tri))).encode())
+        options = dict((name, value) for name, value in (options or {}).items()
+                       if name not in RUNTIME_OPTIONS)
+        if options:
+            h.update((json.dumps(options, sort_keys=True) + "|").encode())
+        # float32 and float64 copies of a mesh share the key
+        for start in range(0, len(tri), CHUNK_SIZE):
+            chunk = tri[start:start + CHUNK_SIZE]
+            h.update(np.ascontiguousarray(chunk, dtype="<f8").tobytes())
+        return h.hexdigest()
+
+
+    def get(self, key):
+        '''Returning the cached result values of key or None'''
+        with self.transaction():
+            row = self.db.execute("SELECT value FROM results WHERE key = ?",
+                                  (key,)).fetchone()
+            if row is None:
+                self.db.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+            else:
+                self.db.execute("UPDATE results SET atime = ? WHERE key = ?",
+                                (time.time(), key))
+                self.db.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+
+    def put(self, key, result):
+        '''Storing the result of a Tweak, evicting the least recently used
+        results beyond max_entries'''
+        values = json.dumps(dict((field, getattr(result, field)) for field in FIELDS))
+        with self.transaction():
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                            (key, values, time.time()))
+            count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                self.db.execute("""DELETE FROM results WHERE key IN (SELECT key
+                    FROM results ORDER BY atime LIMIT ?)""", (count - self.max_entries,))
+                self.db.execute("UPDATE counters SET value = value + ? WHERE name = 'evictions'",
+                                (count - self.max_entries,))
+
+
+    def tweak(self, mesh, bi_algorithmic, CA=45, tweaker=Tweak, **kwargs):
+        '''Returning the cached result of the mesh or tweaking it with the
+        class tweaker and storing the result'''
+        key = self.key(mesh, CA, bi_algorithmic, kwargs, tweaker)
+        values = self.get(key)
+        if values is not None:
+            return CachedResult(values)
+        result = tweaker(mesh, bi_algorithmic, False, CA, **kwargs)
+        self.put(key, result)
+        return result
+
+
+    def stats(self):
+        '''Returning the number of entries and the counters of all processes'''
+        stats = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+        stats["entries"] = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return stats
+
+
+    def close(self):
+        self.db.close()
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.db.execute("COMMIT")
+        else:
+            self.db.execute("ROLLBACK")
@@ -0,0 +1,86 @@
+# Python 2.7 and 3.5
+# Sweeping the critical angle and the weights of the target function.
+#
+# python Tweaker.py -i part.stl --sweep 30:70:5 --abslimit 50,100,200
+# writes the best orientation of every combination into part_sweep.csv.
+
+import csv
+import itertools
+import numpy as np
+from ArrayTweaker import OrientationAnalysis
+from FileHandler import FileHandler
+
+COLUMNS = ("object", "CA", "ABSLIMIT", "RELLIMIT", "LINE_FAKTOR", "Zn_x",
+           "Zn_y", "Zn_z", "phi", "Unprintability", "bottomArea", "overhang",
+           "line")
+
+
+def parse_range(text):
+    '''Returning the values of a comma separated list like "30,45,60" or of
+    an inclusive range like "30:70:5", whose step defaults to 1'''
+    values = list()
+    for part in text.split(","):
+        if ":" in part:
+            bounds = [float(i) for i in part.split(":")]
+            if len(bounds) not in (2, 3) or (len(bounds) == 3 and bounds[2] <= 0):
+                raise ValueError("Ranges are given as start:stop[:step], got %r" % part)
+            if not np.isfinite(bounds).all():
+                raise ValueError("Values must be finite, got %r" % part)
+            start, stop = bounds[:2]
+            step = bounds[2] if len(bounds) == 3 else 1.0
+            count = int(np.floor((stop - start) / step + 1e-9)) + 1
+            values += [round(start + i * step, 10) for i in range(max(count, 0))]
+        elif part.strip():
+            values.append(float(part))
+    for i in values:
+        if not np.isfinite(i):
+            raise ValueError("Values must be finite, got %r" % text)
+    # Whole numbers are written as such into the table
+    return [int(i) if i == int(i) else i for i in values]
+
+
+def sweep(mesh, angles, ABSLIMIT=(100,), RELLIMIT=(1,), LINE_FAKTOR=(0.5,),
+          bi_algorithmic=False, **kwargs):
+    '''Returning the best orientation of the mesh for every combination of
+    the critical angles and weights as list of dicts with the keys of
+    COLUMNS, but object. The candidates are searched and the facets are
+    projected only once, see OrientationAnalysis, whose further arguments
+    are passed by kwargs. Each angle needs one threshold pass, each
+    combination of weights a ranking of the candidates.'''
+    angles = list(angles)
+    if not angles:
+        return list()
+    x = OrientationAnalysis(mesh, bi_algorithmic, False, angles[0], **kwargs)
+    rows = list()
+    for CA in angles:
+        liste = x.evaluate(CA)
+        for weights in itertools.product(ABSLIMIT, RELLIMIT, LINE_FAKTOR):
+            x.ABSLIMIT, x.RELLIMIT, x.LINE_FAKTOR = weights
+            Unprintability, bestside = x.best_orientation(liste)
+            x.set_result(Unprintability, bestside)
+            rows.append(dict(CA=CA, ABSLIMIT=weights[0], RELLIMIT=weights[1],
+                             LINE_FAKTOR=weights[2], Zn_x=x.Zn[0], Zn_y=x.Zn[1],
+                             Zn_z=x.Zn[2], phi=x.phi, Unprintability=Unprintability,
+                             bottomArea=x.bottomArea, overhang=x.overhang,
+                             line=x.line))
+    return rows
+
+
+def sweep_file(inputfile, angles, **kwargs):
+    '''Sweeping every object of a mesh file, which is loaded once. Returns
+    the rows of all objects, see sweep().'''
+    rows = list()
+    for i, obj in enumerate(FileHandler().loadMesh(inputfile, arrays=True) or ()):
+        for row in sweep(obj["Mesh"], angles, **kwargs):
+            row["object"] = i
+            rows.append(row)
+    return rows
+
+
+def write_csv(rows, path):
+    '''Writing the rows of sweep() as table with the header COLUMNS'''
+    with open(path, "w") as f:
+        writer = csv.DictWriter(f, COLUMNS, extrasaction="ignore",
+                                lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
@@ -1,11 +1,16 @@
-# Python 2.7 and 3.5
+# Python 2.7 and 3.5, writing 3MF files needs Python 3.6
 # Author: Christoph Schranz, Salzburg Research
 
-import sys, os
+import sys
 import struct
-import time
 import zipfile
+import itertools
+import re
+import array
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
+import numpy as np
+from IndexedMesh import IndexedMesh
 
 
 namespace = {
@@ -13,120 +18,274 @@ namespace = {
     "m" : "http://schemas.microsoft.com/3dmanufacturing/material/2015/02"
 }
 
-def Read3mf(f):
-    '''load parts of the 3mf with their properties'''
+MODEL_PATH = "3D/3dmodel.model"
+CORE = "{%s}" % namespace["3mf"]
+IDENTITY = np.eye(4)
+
+# Build items of the model XML, which rotate3MF rewrites
+BUILD_START = re.compile(br"<(?:[\w.-]+:)?build[\s/>]")
+BUILD_END = re.compile(br"</(?:[\w.-]+:)?build\s*>")
+ITEM = re.compile(br"<((?:[\w.-]+:)?item)(\s[^>]*?)?(/?)>")
+TRANSFORM = re.compile(br"\stransform\s*=\s*([\"'])(.*?)\1")
+COPY_BLOCK_SIZE = 1 << 20
+# Writing archive members as streams needs ZipFile.open(name, "w"), and
+# copyMember relies on the central directory of zout as kept since then
+CAN_WRITE = sys.version_info >= (3, 6)
+
+
+def Read3mf(f, arrays=False):
+    '''load parts of the 3mf with their properties. With arrays, the meshs
+    are returned as IndexedMesh instead of vertex lists.
+    Each object with a mesh has the keys "objectid", "Mesh" and, if the build
+    places it, "Transform", the 3MF transform of its first placement with
+    all component transforms applied, and "item", the index of that build
+    item.'''
     # The base object of 3mf is a zipped archive.
     archive = zipfile.ZipFile(f, "r")
     try:
-        root = ET.parse(archive.open("3D/3dmodel.model"))
+        with archive.open(MODEL_PATH) as model:
+            objects, build = parseModel(model)
 
-        # There can be multiple objects, try to load all of them.
-        objects = root.findall("./3mf:resources/3mf:object", namespace)
-        if len(objects) == 0:
-            print("No objects found in 3MF file %s, either the file is damaged or you are using an outdated format", f)
-            return None
-        
         obj_meshs = list()
-        c=0
-        for obj in objects:
-            if obj.findall(".//3mf:mesh", namespace) == []:
+        placements = resolveBuild(objects, build)
+        for objectid, obj in objects.items():
+            if obj["mesh"] is None:
                 continue
-            obj_meshs.append(dict())
-            
-            objectid = obj.get("id")
-            obj_meshs[c]["objectid"] = objectid
-            
-            vertex_list = []
-            obj_meshs[c]["Mesh"] = list()
-            #for vertex in object.mesh.vertices.vertex:
-            for vertex in obj.findall(".//3mf:vertex", namespace):
-                vertex_list.append([vertex.get("x"), vertex.get("y"), vertex.get("z")])
-                
-            triangles = obj.findall(".//3mf:triangle", namespace)
-            #for triangle in object.mesh.triangles.triangle:
-            for triangle in triangles:
-                v1 = int(triangle.get("v1"))
-                v2 = int(triangle.get("v2"))
-                v3 = int(triangle.get("v3"))
-                obj_meshs[c]["Mesh"].append([float(vertex_list[v1][0]),float(vertex_list[v1][1]),float(vertex_list[v1][2])])
-                obj_meshs[c]["Mesh"].append([float(vertex_list[v2][0]),float(vertex_list[v2][1]),float(vertex_list[v2][2])])
-                obj_meshs[c]["Mesh"].append([float(vertex_list[v3][0]),float(vertex_list[v3][1]),float(vertex_list[v3][2])])
-
-
-            try:
-                obj_meshs[c]["Transform"] = getTransformation(root, objectid)
-            except:
-                pass
-
-##            try:
-##                color_list = list()
-##                colors = root.findall('.//m:color', namespace)
-##                if colors:
-##                    for color in colors:
-##                        color_list.append(color.get("color",0))
-##                    obj_meshs[c]["color"] = color_list
-##            except AttributeError:
-##                pass # Empty list was found. Getting transformation is not possible
-
-            c=c+1
+            vertices, faces = obj["mesh"]
+            mesh = IndexedMesh(vertices, faces).compact()
+            if not arrays:
+                mesh = np.asarray(mesh).reshape(-1, 3).tolist()
+            obj_meshs.append({"objectid": objectid, "Mesh": mesh})
+            if objectid in placements:
+                item, matrix = placements[objectid]
+                obj_meshs[-1]["Transform"] = formatTransform(matrix)
+                obj_meshs[-1]["item"] = item
 
+        # There can be multiple objects, try to load all of them.
+        if len(obj_meshs) == 0:
+            print("No objects found in 3MF file %s, either the file is damaged or you are using an outdated format" % f)
+            return None
             
     except Exception as e:
         print("exception occured in 3mf reader: %s" % e)
         return None
+    finally:
+        archive.close()
     return obj_meshs
 
 
+def parseModel(model):
+    '''Streaming the model XML with iterparse. Returns the objects by id,
+    in the order of the file, as dicts with the key "mesh", a tuple of the
+    vertex and face arrays or None, and "components", a list of the
+    (objectid, matrix) tuples. The build is returned as list of the
+    (objectid, matrix) tuples of its items. Parsed elements are cleared at
+    once, so only the arrays are held in memory.'''
+    objects = dict()
+    order = list()
+    build = list()
+    obj = container = None
+    in_build = False
+    vertices = faces = None
+    for event, elem in ET.iterparse(model, events=("start", "end")):
+        tag = elem.tag[len(CORE):] if elem.tag.startswith(CORE) else None
+        if event == "start":
+            if tag == "object":
+                obj = {"mesh": None, "components": list()}
+                objects[elem.get("id")] = obj
+                order.append(elem.get("id"))
+            elif tag == "mesh":
+                vertices = array.array("d")
+                faces = array.array("i")
+            elif tag in ("vertices", "triangles"):
+                container = elem
+            elif tag == "build":
+                in_build = True
+            continue
 
-def getTransformation(root, objectid):
-    builds = root.findall(".//3mf:item", namespace)
-    transforms = list()
-    for item in builds:
-        if item.get("transform"):
-            transforms.append((item.get("objectid"), item.get("transform")))
-    components = root.findall(".//3mf:components", namespace)
-    objects = root.findall("./3mf:resources/3mf:object", namespace)
-    for (transid, transform) in transforms:
-        for obj in objects:
-            if transid == obj.get("id"):
-                obj_ids = obj.findall(".//3mf:component", namespace)
-                for obj_id in obj_ids:
-                    if obj_id.get("objectid") == objectid:
-                              #print(transform)
-                              break
-    return transform
-                              
-def rotate3MF(f, outfile, objs):
-    #TODO doesn't work at the moment
-    archive = zipfile.ZipFile(f, "r")
-    root = ET.parse(archive.open("3D/3dmodel.model"))
-    
+        if tag == "vertex":
+            vertices.extend((float(elem.get("x")), float(elem.get("y")),
+                             float(elem.get("z"))))
+            # Dropping the parsed elements from their parent
+            container.clear()
+        elif tag == "triangle":
+            faces.extend((int(elem.get("v1")), int(elem.get("v2")),
+                          int(elem.get("v3"))))
+            container.clear()
+        elif tag == "mesh":
+            obj["mesh"] = (np.frombuffer(vertices, dtype=np.float64).reshape(-1, 3),
+                           np.frombuffer(faces, dtype=np.intc).reshape(-1, 3))
+            vertices = faces = None
+        elif tag == "component":
+            obj["components"].append((elem.get("objectid"),
+                                      parseTransform(elem.get("transform"))))
+        elif tag == "object":
+            obj = None
+            elem.clear()
+        elif tag == "item" and in_build:
+            build.append((elem.get("objectid"), parseTransform(elem.get("transform"))))
+        elif tag == "build":
+            in_build = False
+    return OrderedDict((objectid, objects[objectid]) for objectid in order), build
+
+
+def resolveBuild(objects, build):
+    '''Returning the build item and the transform matrix of the first
+    placement of each mesh object. Component transforms are applied before
+    the transforms of their parents and of the build item.'''
+    placements = dict()
+    for item, (objectid, matrix) in enumerate(build):
+        stack = [(objectid, matrix, 0)]
+        while stack:
+            objectid, matrix, depth = stack.pop()
+            obj = objects.get(objectid)
+            if obj is None or depth > len(objects):
+                continue  # Missing or cyclic reference
+            if obj["mesh"] is not None and objectid not in placements:
+                placements[objectid] = (item, matrix)
+            for componentid, component in reversed(obj["components"]):
+                stack.append((componentid, np.dot(component, matrix), depth + 1))
+    return placements
+
+
+def parseTransform(transform):
+    '''Returning the 4x4 matrix of a 3MF transform attribute. 3MF
+    transforms are applied to row vectors, p' = [x y z 1] * M.'''
+    if not transform:
+        return IDENTITY
+    values = [float(value) for value in transform.split()]
+    if len(values) != 12:
+        raise ValueError("Transform must have 12 values, got %r" % transform)
+    matrix = np.eye(4)
+    matrix[:, :3] = np.reshape(values, (4, 3))
+    return matrix
+
+
+def formatTransform(matrix):
+    '''Returning the 3MF transform attribute of a 4x4 matrix'''
+    return " ".join("%.9g" % value for value in matrix[:, :3].ravel())
+
+
+def rotate3MF(f, outfile, objs, block_size=COPY_BLOCK_SIZE):
+    '''Writing the 3mf f as outfile with the objects rotated by their
+    rotation matrices "R", as given by Tweak. objs are the objects returned
+    by Read3mf, objects without "R" or without placement stay as they are.
+    The tweaked objects keep their position, their former rotation is
+    replaced by R. If several objects share a build item, the first one
+    rotates the item.
+    Only the build items of the model part are rewritten, streaming the
+    model. All other archive members are copied as they are, without
+    decompressing them. Needs Python 3.6 or newer, see CAN_WRITE.'''
+    if not CAN_WRITE:
+        raise RuntimeError("Writing 3MF files needs Python 3.6 or newer")
+    placements = dict()
     for obj in objs:
-        itemid = None
-        # get build id for transform value
-        objects3MF = root.findall("./3mf:resources/3mf:object", namespace)
-        for elem in objects3MF:
-            for component in elem.findall(".//3mf:component", namespace):
-                    if component.get("objectid") == obj["objectid"]:
-                            #print("objid", elem.get("id"))
-                            itemid = elem.get("id")
-
-        if itemid:
-            for item in root.findall(".//3mf:build/3mf:item", namespace):
-                if item.get("objectid") == itemid:
-                    item.set("transform", obj["transform"])
-        else:
-            pass
+        if obj.get("R") is not None and "item" in obj and obj["item"] not in placements:
+            placements[obj["item"]] = obj
+
+    with zipfile.ZipFile(f, "r") as zin, zipfile.ZipFile(outfile, "w") as zout:
+        zout.comment = zin.comment
+        for zinfo in zin.infolist():
+            if zinfo.filename != MODEL_PATH:
+                copyMember(zin, zout, zinfo, block_size)
+                continue
+            with zin.open(zinfo) as src, zout.open(memberInfo(zinfo), "w",
+                                                   force_zip64=True) as dst:
+                rewriteBuild(src, dst, placements, block_size)
 
-    #Writing the changed model in the output file
-    indir = os.path.splitext(f)[0]
-    zipf = zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED)
-    zipdir(indir, zipf)
-    zipf.close()
+
+def memberInfo(zinfo):
+    '''Returning a new ZipInfo with the name, date, compression and
+    attributes of zinfo'''
+    info = zipfile.ZipInfo(zinfo.filename, zinfo.date_time)
+    info.compress_type = zinfo.compress_type
+    info.external_attr = zinfo.external_attr
+    info.comment = zinfo.comment
+    return info
+
+
+def copyMember(zin, zout, zinfo, block_size=COPY_BLOCK_SIZE):
+    '''Copying the member zinfo of zin into zout without decompressing it.
+    A new local header is written, followed by the compress_size bytes of
+    the member data in zin. A data descriptor is not needed, as the header
+    holds the CRC and sizes.'''
+    zin.fp.seek(zinfo.header_offset)
+    header = zin.fp.read(30)
+    if len(header) != 30 or header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile("Bad local header of %s" % zinfo.filename)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    zin.fp.seek(zinfo.header_offset + 30 + name_length + extra_length)
+
+    info = memberInfo(zinfo)
+    info.flag_bits = zinfo.flag_bits & ~0x08
+    info.CRC = zinfo.CRC
+    info.compress_size = zinfo.compress_size
+    info.file_size = zinfo.file_size
+    info.header_offset = zout.fp.tell()
+    zout.fp.write(info.FileHeader())
+    length = zinfo.compress_size
+    while length > 0:
+        block = zin.fp.read(min(block_size, length))
+        if not block:
+            raise zipfile.BadZipFile("%s is truncated" % zinfo.filename)
+        zout.fp.write(block)
+        length -= len(block)
+    # Registering the member, so zout writes it into the central directory
+    zout.filelist.append(info)
+    zout.NameToInfo[info.filename] = info
+    zout.start_dir = zout.fp.tell()
+
+
+def rewriteBuild(src, dst, placements, block_size=COPY_BLOCK_SIZE):
+    '''Copying the model XML from src to dst, with new transforms of the
+    build items of placements, which maps item indices to the objects'''
+    data = b""
+    while True:
+        block = src.read(block_size)
+        data += block
+        start = BUILD_START.search(data)
+        if start is None:
+            # The tail might hold the start of a split build tag
+            keep = max(len(data) - 64, 0) if block else len(data)
+            dst.write(data[:keep])
+            data = data[keep:]
+        else:
+            end = BUILD_END.search(data, start.end())
+            if end is not None:
+                dst.write(data[:start.start()])
+                items = itertools.count()
+                dst.write(ITEM.sub(lambda m: rewriteItem(m, next(items), placements),
+                                   data[start.start():end.end()]))
+                dst.write(data[end.end():])
+                break
+            if not block:
+                dst.write(data)  # Empty build
+        if not block:
+            return
+    while True:
+        block = src.read(block_size)
+        if not block:
+            break
+        dst.write(block)
 
 
-def zipdir(path, ziph):
-    # ziph is zipfile handle
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            ziph.write(os.path.join(root, file))
+def rewriteItem(match, index, placements):
+    '''Returning the item tag of match with the transform of its object'''
+    if index not in placements:
+        return match.group(0)
+    obj = placements[index]
+    attributes = match.group(2) or b""
+    old = TRANSFORM.search(attributes)
+    item = parseTransform(old.group(2).decode() if old else None)
+    placement = parseTransform(obj["Transform"])
+    tweaked = np.eye(4)
+    tweaked[:3, :3] = obj["R"]
+    tweaked[3, :3] = placement[3, :3]
+    # The components of the item are placed by placement * item^-1
+    matrix = np.dot(np.dot(item, np.linalg.inv(placement)), tweaked)
+    transform = (' transform="%s"' % formatTransform(matrix)).encode()
+    if old:
+        attributes = attributes[:old.start()] + transform + attributes[old.end():]
+    else:
+        attributes = attributes.rstrip() + transform
+    return b"<" + match.group(1) + attributes + match.group(3) + b">"
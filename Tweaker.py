@@ -7,7 +7,9 @@ import sys, argparse
 import os
 import time
 from MeshTweaker import Tweak
+from ResultCache import ResultCache
 import FileHandler
+import ThreeMF
 
 
 def getargs():
@@ -26,6 +28,22 @@ def getargs():
                         help="specify critical angle for overhang demarcation in degrees")
     parser.add_argument('-b', '--bi', action="store_true", dest="bi_algorithmic", default=False,
                         help="using two algorithms for calculation")
+    parser.add_argument('-B', '--binary', action="store_true", dest="binary", default=False,
+                        help="write the tweaked STL in binary instead of ascii format")
+    parser.add_argument('-w', '--workers', action="store", dest="workers", type=int,
+                        default=None,
+                        help="number of worker processes, if the input is a directory")
+    parser.add_argument('--cache', action="store", dest="cache", default=None,
+                        help="reuse the results of known meshs, stored in this SQLite file")
+    parser.add_argument('--sweep', action="store", dest="sweep", default=None,
+                        help="write the best orientation for each of these critical angles, "
+                        "like 30:70:5 or 30,45,60, into a CSV table instead of tweaking")
+    parser.add_argument('--abslimit', action="store", dest="abslimit", default="100",
+                        help="values of the target function weight ABSLIMIT to sweep")
+    parser.add_argument('--rellimit', action="store", dest="rellimit", default="1",
+                        help="values of the target function weight RELLIMIT to sweep")
+    parser.add_argument('--line-faktor', action="store", dest="line_faktor", default="0.5",
+                        help="values of the target function weight LINE_FAKTOR to sweep")
     parser.add_argument('-v', '--version', action="store_true", dest="version",
                         help="print version number and exit", default=False)
     parser.add_argument('-r', '--result', action="store_true", dest="result",
@@ -45,9 +63,16 @@ def getargs():
             
         except:
             return None          
-    if not args.outputfile:
+    if not args.outputfile and args.sweep:
+        args.outputfile = os.path.splitext(args.inputfile)[0] + "_sweep.csv"
+    elif not args.outputfile and os.path.isdir(args.inputfile):
+        args.outputfile = args.inputfile.rstrip(os.sep) + "_tweaked"
+    elif not args.outputfile:
         args.outputfile = os.path.splitext(args.inputfile)[0] + "_tweaked"
-        args.outputfile += ".stl" #Because 3mf is not supported for output #TODO
+        if os.path.splitext(args.inputfile)[1].lower() == ".3mf" and ThreeMF.CAN_WRITE:
+            args.outputfile += ".3mf"
+        else:
+            args.outputfile += ".stl"
 
     argv = sys.argv[1:]
     if len(argv)==0:
@@ -70,6 +95,49 @@ if __name__ == "__main__":
     except:
         raise
         
+    ## Sweep mode: one table of the best orientations of a single file.
+    if args.sweep:
+        from Sweep import parse_range, sweep_file, write_csv
+        try:
+            rows = sweep_file(args.inputfile, parse_range(args.sweep),
+                              ABSLIMIT=parse_range(args.abslimit),
+                              RELLIMIT=parse_range(args.rellimit),
+                              LINE_FAKTOR=parse_range(args.line_faktor),
+                              bi_algorithmic=args.bi_algorithmic)
+        except ValueError as e:
+            print("Sweep failed: {}".format(e))
+            sys.exit(1)
+        write_csv(rows, args.outputfile)
+        if args.verbose:
+            print("Swept {} combinations in {:2f} s into {}".format(len(rows),
+                  time.time()-stime, args.outputfile))
+        sys.exit()
+
+    ## Batch mode: tweak all files of a directory in parallel.
+    if os.path.isdir(args.inputfile):
+        from BatchTweaker import tweak_files, find_files
+        outdir = None
+        if not args.result:
+            outdir = args.outputfile
+            if not os.path.isdir(outdir):
+                os.makedirs(outdir)
+        failed = 0
+        for res in tweak_files(find_files(args.inputfile), args.workers,
+                               args.bi_algorithmic, args.angle, outdir, args.binary,
+                               args.cache):
+            name = os.path.basename(res["file"])
+            if res["objects"] > 1:
+                name += " ({})".format(res["object"])
+            if res["error"]:
+                failed += 1
+                print("{}: \tfailed, {}".format(name, res["error"]))
+            else:
+                print("{}: \tZn {}, Unprintability {}, {:2f} s".format(name,
+                      res["Zn"], res["Unprintability"], res["time"]))
+        if args.verbose:
+            print("Tweaking took:  \t{:2f} s, {} failed".format(time.time()-stime, failed))
+        sys.exit()
+
     try:
         #print(args.inputfile)
         FileHandler = FileHandler.FileHandler()
@@ -93,7 +161,10 @@ if __name__ == "__main__":
         else:
             try:
                 cstime = time.time()
-                x=Tweak(mesh, args.bi_algorithmic, args.verbose, args.angle)
+                if args.cache:
+                    x=ResultCache(args.cache).tweak(mesh, args.bi_algorithmic, args.angle)
+                else:
+                    x=Tweak(mesh, args.bi_algorithmic, args.verbose, args.angle)
                 R=x.R
             except (KeyboardInterrupt, SystemExit):
                 print("\nError, tweaking process failed!")
@@ -118,24 +189,22 @@ if __name__ == "__main__":
           
         ## Creating tweaked output file
         if os.path.splitext(args.outputfile)[1].lower() in ["stl", ".stl"]:
-            # If you want to write in binary, use the function rotatebinSTL(...)"
-            tweakedcontent=FileHandler.rotateSTL(R, mesh, args.inputfile)       
-            # Support structure suggestion can be used for further applications        
-            #if x.Unprintability > 7:
-            #    tweakedcontent+=" {supportstructure: yes}"
             if len(objs)<=1:
                 outfile = args.outputfile
             else:
                 outfile = os.path.splitext(args.outputfile)[0]+" ({})".format(c)+os.path.splitext(args.outputfile)[1]
-            with open(outfile,'w') as outfile: # If you want to write in binary, open with "wb"
-                outfile.write(tweakedcontent)
+            FileHandler.writeSTL(R, mesh, outfile, args.inputfile, binary=args.binary)
 
         else:
-            transformation = "{} {} {} {} {} {} {} {} {} 0 0 1".format(x.R[0][0], x.R[0][1], x.R[0][2],
-                                x.R[1][0], x.R[1][1], x.R[1][2], x.R[2][0], x.R[2][1], x.R[2][2])
-            obj["transform"] = transformation
-            FileHandler.rotate3MF(args.inputfile, args.outputfile, objs)
+            obj["R"] = R
+        c += 1
 
+    ## The 3mf is written once, with the transforms of all objects
+    if os.path.splitext(args.outputfile)[1].lower() not in ["stl", ".stl"]:
+        if os.path.splitext(args.inputfile)[1].lower() != ".3mf":
+            print("3MF output needs a 3MF input file, use a .stl output file.")
+            sys.exit(1)
+        FileHandler.rotate3MF(args.inputfile, args.outputfile, objs)
     
 
     ## Success message
@@ -0,0 +1,250 @@
+# Python 3.9
+# Long-running orientation service with a warm pool of worker processes.
+#
+# Start with "python TweakerDaemon.py [--port 8765 | --socket PATH]".
+# POST /tweak tweaks a file, given as JSON {"path": ...} or as raw ascii or
+# binary STL body. The query parameters angle and bi set the critical angle
+# and the bi-algorithmic mode. GET /status reports the load of the service.
+
+import os
+import json
+import time
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+from BatchTweaker import tweak_object
+from FileHandler import FileHandler
+from ResultCache import ResultCache
+
+DEFAULT_PORT = 8765
+# Larger request bodies are refused with 413
+DEFAULT_MAX_BODY = 256 << 20
+
+
+class TweakerService:
+    """ The TweakerService runs tweak requests in a pool of worker processes,
+    which are started and warmed up at once. At most max_queue requests are
+    accepted at a time, further ones are refused by submit(), so the caller
+    can answer them with "busy" instead of piling them up.
+    """
+    def __init__(self, workers=None, max_queue=64, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.cache = cache
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.served = 0
+        self.refused = 0
+        self.failed = 0
+        # Start every worker and run a tiny tweak, so the first request is fast
+        list(self.pool.map(_warm_up, range(self.workers)))
+
+
+    def submit(self, path=None, body=None, CA=45, bi_algorithmic=False):
+        '''Queueing the tweak of a file path or of the STL bytes body.
+        Returns a future of the result dict or None, if the queue is full.'''
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.refused += 1
+            return None
+        with self.lock:
+            self.pending += 1
+        options = dict(bi_algorithmic=bi_algorithmic, CA=CA, outdir=None,
+                       binary=False, cache=self.cache)
+        try:
+            future = self.pool.submit(_tweak_request, path, body, options)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+
+    def _release(self, future):
+        with self.lock:
+            self.pending -= 1
+            # Futures cancelled by close() have no exception to ask for
+            if future is None or future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.served += 1
+        self.slots.release()
+
+
+    def status(self):
+        with self.lock:
+            return dict(workers=self.workers, max_queue=self.max_queue,
+                        pending=self.pending, served=self.served,
+                        refused=self.refused, failed=self.failed)
+
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _warm_up(i):
+    tetrahedron = np.array([[[0, 0, 0], [1, 0, 0], [0, 1, 0]],
+                            [[0, 0, 0], [0, 0, 1], [1, 0, 0]],
+                            [[0, 0, 0], [0, 1, 0], [0, 0, 1]],
+                            [[1, 0, 0], [0, 0, 1], [0, 1, 0]]], dtype=float)
+    tweak_object("warm-up", 0, 1, tetrahedron, dict(bi_algorithmic=False,
+                 CA=45, outdir=None, binary=False, cache=None))
+    return i
+
+
+def _tweak_request(path, body, options):
+    '''Tweaking all objects of a request in a worker process'''
+    stime = time.time()
+    if body is not None:
+        path = "request"
+        objs = [{"Mesh": FileHandler().readSTLBytes(body, path)}]
+    else:
+        objs = FileHandler().loadMesh(path, arrays=True)
+    if not objs:
+        raise ValueError("No objects found in %s" % path)
+    results = list()
+    for i, obj in enumerate(objs):
+        result = tweak_object(path, i, len(objs), obj["Mesh"], options)
+        del result["file"], result["objects"], result["error"]
+        results.append(result)
+    return dict(file=path, objects=results, time=time.time() - stime)
+
+
+class TweakerHandler(BaseHTTPRequestHandler):
+    """ HTTP interface of the TweakerService of the server. """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/status":
+            return self.reply(404, {"error": "Unknown path, use GET /status"})
+        status = self.server.service.status()
+        if self.server.service.cache:
+            # SQLite connections can not be shared by the handler threads
+            cache = ResultCache(self.server.service.cache)
+            status["cache"] = cache.stats()
+            cache.close()
+        self.reply(200, status)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/tweak":
+            return self.reply(404, {"error": "Unknown path, use POST /tweak"})
+        try:
+            query = parse_qs(url.query)
+            CA = float(query.get("angle", [45])[0])
+            bi_algorithmic = query.get("bi", ["0"])[0].lower() in ("1", "true", "yes")
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError("Negative Content-Length")
+            if length > self.server.max_body:
+                # The body is not read, so the connection can not be reused
+                self.close_connection = True
+                return self.reply(413, {"error": "Request body larger than %d bytes"
+                                        % self.server.max_body})
+            body = self.rfile.read(length)
+            path = None
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                path = json.loads(body.decode())["path"]
+                body = None
+        except (ValueError, KeyError, TypeError) as e:
+            return self.reply(400, {"error": "Bad request: %s" % e})
+
+        future = self.server.service.submit(path, body, CA, bi_algorithmic)
+        if future is None:
+            return self.reply(503, {"error": "Too many requests, try again later"},
+                              {"Retry-After": "1"})
+        try:
+            self.reply(200, future.result())
+        except Exception as e:
+            self.reply(422, {"error": "%s: %s" % (type(e).__name__, e)})
+
+    def reply(self, code, content, headers={}):
+        data = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ("local", 0)
+
+
+def serve(service, host="127.0.0.1", port=DEFAULT_PORT, unix_socket=None,
+          verbose=False, max_body=DEFAULT_MAX_BODY):
+    '''Serving the requests for service until interrupted. Request bodies
+    larger than max_body bytes are refused.'''
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, TweakerHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), TweakerHandler)
+    server.service = service
+    server.verbose = verbose
+    server.max_body = max_body
+    if verbose:
+        print("Tweaker service with {} workers listening on {}".format(
+            service.workers, unix_socket or "http://{}:{}".format(host, port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+def getargs(argv=None):
+    parser = argparse.ArgumentParser(description=
+            "Orientation service for better 3D prints")
+    parser.add_argument('--host', action="store", dest="host", default="127.0.0.1",
+                        help="address to listen on")
+    parser.add_argument('-p', '--port', action="store", dest="port", type=int,
+                        default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument('-s', '--socket', action="store", dest="socket", default=None,
+                        help="listen on this unix socket instead of a port")
+    parser.add_argument('-w', '--workers', action="store", dest="workers", type=int,
+                        default=None, help="number of worker processes")
+    parser.add_argument('-q', '--queue', action="store", dest="queue", type=int,
+                        default=64, help="number of requests accepted at once")
+    parser.add_argument('--max-body', action="store", dest="max_body", type=int,
+                        default=DEFAULT_MAX_BODY, help="largest request body in bytes")
+    parser.add_argument('--cache', action="store", dest="cache", default=None,
+                        help="reuse the results of known meshs, stored in this SQLite file")
+    parser.add_argument('-vb', '--verbose', action="store_true", dest="verbose",
+                        help="log every request", default=False)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = getargs()
+    service = TweakerService(args.workers, args.queue, args.cache)
+    try:
+        serve(service, args.host, args.port, args.socket, args.verbose,
+              args.max_body)
+    finally:
+        service.close()
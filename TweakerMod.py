@@ -12,7 +12,7 @@ import FileHandler as FH
 
 def getargs(fileName):
     parser = argparse.ArgumentParser()                           
-    args = parser.parse_args()
+    args = parser.parse_args([]) # Not sys.argv, as this module is embedded
     args.version=False
     args.inputfile=fileName
     args.outputfile=None
@@ -35,15 +35,15 @@ def getargs(fileName):
         args.outputfile = os.path.splitext(args.inputfile)[0] + "_tweaked"
         args.outputfile += ".stl" #Because 3mf is not supported for output #TODO
 
-    argv = sys.argv[1:]
-    if len(argv)==0:
-        args.convert = False
-        args.verbose = True
-        args.bi_algorithmic = False            
+    args.convert = False
+    args.verbose = True
+    args.bi_algorithmic = False            
     return args
 
 
-def readSTL(fileName,printInfo=False):
+def readSTL(fileName,printInfo=False,cache=None):
+    '''Tweaking the file. With a ResultCache as cache, known meshs are not
+    tweaked again.'''
     ## Get the command line arguments. Run in IDE for demo tweaking.
     stime=time.time()
     try:
@@ -74,7 +74,10 @@ def readSTL(fileName,printInfo=False):
         else:
             try:
                 cstime = time.time()
-                x=Tweak(mesh, args.bi_algorithmic, printInfo, args.angle)
+                if cache is None:
+                    x=Tweak(mesh, args.bi_algorithmic, printInfo, args.angle)
+                else:
+                    x=cache.tweak(mesh, args.bi_algorithmic, args.angle)
                 R=x.R
             except (KeyboardInterrupt, SystemExit):
                 print("\nError, tweaking process failed!")
@@ -5,13 +5,14 @@ from stl import mesh
 #from matplotlib import pyplot
 #from mpl_toolkits import mplot3d
 import TweakerMod
+from ResultCache import ResultCache
 #import pickle
 import time
 import os
 
 #finds the optimal print angle, overhang, and printability
 def parseSTL(fileName,printMod):
-	output=TweakerMod.readSTL(os.path.join(filePathToSTLs,fileName),printMod)
+	output=TweakerMod.readSTL(os.path.join(filePathToSTLs,fileName),printMod,resultCache)
 	orientation=output.Zn
 	overhang=output.overhang
 	unprintability=output.Unprintability 
@@ -79,6 +80,7 @@ def parse(fileName,printModifications=False,printSTLFile=False,printBasicInfo=Tr
 
 
 filePathToSTLs="/afs/csl.tjhsst.edu/students/2018/2018jblinden/3dprint/STLs/"
+resultCache=ResultCache() #orientations of known STLs are reused
 loadFromFile()
 
 #loadPickle("populars.p")
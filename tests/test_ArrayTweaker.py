@@ -0,0 +1,69 @@
+# Python 3.5
+# ArrayTweak has to choose the orientations of Tweak on the bundled STLs.
+
+import os
+import sys
+import unittest
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from MeshTweaker import Tweak
+from ArrayTweaker import ArrayTweak
+from IndexedMesh import IndexedMesh
+from FileHandler import FileHandler
+from Benchmark import death_star, noisy_scan
+
+STL_DIR = os.path.join(ROOT, "STLs")
+ANGLES = (30, 45, 60)
+# Larger synthetic meshs, whose facets are scored. With radius 40, the
+# death star has areas, that np.round rounded to the other side than Tweak
+SHAPES = (death_star, noisy_scan)
+FACETS = 8000
+RADII = (20.0, 40.0)
+
+
+class ArrayTweakTest(unittest.TestCase):
+    """ The tolerance of ArrayTweak: Unprintability within 1e-6 of Tweak,
+    the same Zn and R. """
+    def meshs(self):
+        for name in sorted(os.listdir(STL_DIR)):
+            if name.lower().endswith(".stl"):
+                path = os.path.join(STL_DIR, name)
+                yield name, FileHandler().loadMesh(path)[0]["Mesh"]
+
+    def assertSameResult(self, a, b):
+        self.assertEqual(a.Zn, b.Zn)
+        self.assertEqual(a.R, b.R)
+        self.assertAlmostEqual(a.Unprintability, b.Unprintability, delta=1e-6)
+
+    def test_triangle_arrays(self):
+        for name, mesh in self.meshs():
+            triangles = np.array(mesh, dtype=np.float64).reshape(-1, 3, 3)
+            for CA in ANGLES:
+                with self.subTest(name=name, CA=CA):
+                    self.assertSameResult(Tweak(mesh, False, False, CA),
+                                          ArrayTweak(triangles, False, False, CA))
+
+    def test_indexed_meshs(self):
+        for name, mesh in self.meshs():
+            indexed = IndexedMesh.from_triangles(np.array(mesh).reshape(-1, 3, 3))
+            for CA in ANGLES:
+                with self.subTest(name=name, CA=CA):
+                    self.assertSameResult(Tweak(mesh, False, False, CA),
+                                          ArrayTweak(indexed, False, False, CA))
+
+    def test_large_meshs(self):
+        for shape in SHAPES:
+            for radius in RADII:
+                triangles = shape(FACETS, radius=radius)
+                mesh = triangles.reshape(-1, 3).tolist()
+                for CA in ANGLES:
+                    with self.subTest(shape=shape.__name__, radius=radius, CA=CA):
+                        self.assertSameResult(Tweak(mesh, False, False, CA),
+                                              ArrayTweak(triangles, False, False, CA))
+
+
+if __name__ == "__main__":
+    unittest.main()
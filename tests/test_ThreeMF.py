@@ -0,0 +1,115 @@
+# Python 3.6
+# rotate3MF has to rewrite the build transforms and copy all other members.
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import zipfile
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ThreeMF import Read3mf, rotate3MF, parseTransform, MODEL_PATH, CAN_WRITE
+
+CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8"?>'
+                 '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                 '<Default Extension="model" ContentType='
+                 '"application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/></Types>')
+FACES = ((0, 2, 1), (1, 2, 3), (4, 5, 6), (5, 7, 6), (0, 1, 4), (1, 5, 4),
+         (2, 6, 3), (3, 6, 7), (0, 4, 2), (2, 4, 6), (1, 3, 5), (3, 7, 5))
+# Rotation by 90 degrees about the x axis
+R = [[1, 0, 0], [0, 0, -1], [0, 1, 0]]
+
+
+def model(count):
+    '''Returning the model XML of count cubes, placed side by side'''
+    objects = items = ""
+    for i in range(count):
+        vertices = "".join('<vertex x="%d" y="%d" z="%d"/>' % (x, y, z)
+                           for x in (0, 10) for y in (0, 10) for z in (0, 10))
+        triangles = "".join('<triangle v1="%d" v2="%d" v3="%d"/>' % f for f in FACES)
+        objects += ('<object id="%d" type="model"><mesh><vertices>%s</vertices>'
+                    '<triangles>%s</triangles></mesh></object>' % (i + 1, vertices, triangles))
+        items += '<item objectid="%d" transform="1 0 0 0 1 0 0 0 1 %d 0 0"/>' % (i + 1, 20 * i)
+    return ('<?xml version="1.0" encoding="UTF-8"?><model unit="millimeter" '
+            'xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">'
+            '<resources>%s</resources><build>%s</build></model>' % (objects, items))
+
+
+class Unseekable(io.RawIOBase):
+    """ A write-only stream, so zipfile writes data descriptors. """
+    def __init__(self, f):
+        self.f = f
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.f.write(data)
+
+
+@unittest.skipUnless(CAN_WRITE, "Writing 3MF files needs Python 3.6")
+class RoundTripTest(unittest.TestCase):
+    """ Read, rotate and read again. The build transforms of the rotated
+    objects hold R, all other members keep their bytes and compression. """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmp, "in.3mf")
+        self.outfile = os.path.join(self.tmp, "out.3mf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, f):
+        with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("[Content_Types].xml", CONTENT_TYPES)
+            z.writestr(MODEL_PATH, model(3))
+            z.writestr("Metadata/thumbnail.png", os.urandom(5000),
+                       compress_type=zipfile.ZIP_STORED)
+            with z.open("Metadata/notes.txt", "w") as member:
+                member.write(b"notes " * 2000)
+
+    def assertRoundTrip(self):
+        objs = Read3mf(self.infile, arrays=True)
+        objs[1]["R"] = R
+        rotate3MF(self.infile, self.outfile, objs)
+
+        for old, new in zip(objs, Read3mf(self.outfile, arrays=True)):
+            matrix = parseTransform(new["Transform"])
+            placement = parseTransform(old["Transform"])
+            if "R" in old:
+                np.testing.assert_allclose(matrix[:3, :3], R, atol=1e-9)
+                np.testing.assert_allclose(matrix[3], placement[3])
+            else:
+                self.assertEqual(new["Transform"], old["Transform"])
+
+        with zipfile.ZipFile(self.infile) as zin, zipfile.ZipFile(self.outfile) as zout:
+            self.assertIsNone(zout.testzip())
+            self.assertEqual(zin.namelist(), zout.namelist())
+            for old, new in zip(zin.infolist(), zout.infolist()):
+                if old.filename == MODEL_PATH:
+                    continue
+                with self.subTest(member=old.filename):
+                    self.assertEqual(old.compress_type, new.compress_type)
+                    self.assertEqual(old.compress_size, new.compress_size)
+                    self.assertEqual(old.CRC, new.CRC)
+                    self.assertEqual(zin.read(old), zout.read(new))
+
+    def test_members(self):
+        self.write(self.infile)
+        self.assertRoundTrip()
+
+    def test_data_descriptors(self):
+        with open(self.infile, "wb") as f:
+            self.write(Unseekable(f))
+        with zipfile.ZipFile(self.infile) as z:
+            self.assertTrue(all(info.flag_bits & 0x08 for info in z.infolist()))
+        self.assertRoundTrip()
+
+
+if __name__ == "__main__":
+    unittest.main()